@@ -1,4 +1,10 @@
-from clustre.adversarial_training._cluster import cluster_training
+from clustre.adversarial_training._cluster import (
+    KMeansWrapper,
+    cluster_training,
+)
+from clustre.adversarial_training._features import extract_features
 from clustre.adversarial_training._fgsm import fgsm_training
 from clustre.adversarial_training._free import free_training
 from clustre.adversarial_training._pgd import pgd_training
+from clustre.adversarial_training._sampler import ClusterBatchSampler
+from clustre.adversarial_training._store import ClusterStore
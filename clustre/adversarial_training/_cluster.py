@@ -1,52 +1,285 @@
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
-import numpy.linalg as la
 from dateutil.relativedelta import relativedelta
 from sklearn.cluster import KMeans
 
 import torch
-from clustre.attacking import fgsm, fgsm_perturbs, pgd, pgd_perturbs
+from clustre.adversarial_training._features import (
+    FEATURES,
+    extract_features,
+    stack_features,
+)
+from clustre.adversarial_training._kmeans import (
+    MiniBatchKMeans,
+    allocate_clusters,
+    hierarchical_kmeans,
+    kmeans,
+    kmeans_sweep,
+    medoids,
+    row_norms,
+)
+from clustre.adversarial_training._reduce import reduce_features
+from clustre.adversarial_training._refresh import (
+    CentroidRefresher,
+    LazyCentroidPerturbs,
+)
+from clustre.adversarial_training._sampler import ClusterBatchSampler
+from clustre.attacking import pgd_perturbs
 from clustre.helpers import delta_time_string, delta_tostr, get_time
-from libKMCUDA import kmeans_cuda
 from torch import nn, optim
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import (
+    BatchSampler,
+    DataLoader,
+    Dataset,
+    RandomSampler,
+    SequentialSampler,
+)
 
 
 # %%
 class KMeansWrapper:
-    def __init__(self, X, n_clusters, n_init=3, method="kmcuda"):
-        if method == "kmcuda":
-            self.inertia = np.inf
-            for _ in range(n_init):
-                centers, y_pred = kmeans_cuda(X.astype(np.float32), n_clusters)
-                full_idx = np.arange(len(X))
-                centroids_idxs = []
-                inertia = 0
-                for i in range(n_clusters):
-                    idx = full_idx[y_pred == i]
-                    if len(idx) != 0:
-                        X_sub = X[idx]
-                        norm = la.norm(X_sub - centers[i], axis=1)
-                        min_idx = norm.argmin()
-                        centroids_idxs.append(idx[min_idx])
-                        inertia += np.sum(norm)
-                    else:
-                        centroids_idxs.append(0)
-                centroids_idxs = np.array(centroids_idxs)
-
-                if inertia < self.inertia:
-                    self.centers = centers
-                    self.y_pred = y_pred
-                    self.centroids_idxs = centroids_idxs
+    def __init__(
+        self,
+        X,
+        n_clusters,
+        n_init=3,
+        method="kmcuda",
+        minibatch=None,
+        n_jobs=None,
+        n_threads=None,
+    ):
+        if method in ["kmcuda", "cpu", "hierarchical"]:
+            n_jobs = min(n_jobs or n_init, n_init)
+            # The CPUs are split across the concurrent restarts
+            n_threads = n_threads or max(1, os.cpu_count() // n_jobs)
+            if method == "kmcuda":
+                # Needs CUDA to build, so only imported when requested
+                from libKMCUDA import kmeans_cuda
+
+                # libKMCUDA needs contiguous float32 samples in memory
+                X = np.ascontiguousarray(X, dtype=np.float32)
+
+                def fit(seed):
+                    return kmeans_cuda(X, n_clusters, seed=seed)
+
+            elif method == "hierarchical":
+
+                def fit(seed):
+                    return hierarchical_kmeans(
+                        X, n_clusters, seed=seed, n_threads=n_threads
+                    )
+
+            else:
+                # Every restart shares the same norms. X keeps its dtype and
+                # storage, and is only converted chunk by chunk
+                x_norms = row_norms(X)
+
+                def fit(seed):
+                    return kmeans(
+                        X,
+                        n_clusters,
+                        seed=seed,
+                        n_threads=n_threads,
+                        x_norms=x_norms,
+                    )
+
+            def run(seed):
+                centers, y_pred = fit(seed)
+                centroids_idxs, inertia = medoids(X, y_pred, centers)
+                return inertia, centers, y_pred, centroids_idxs
+
+            with ThreadPoolExecutor(n_jobs) as executor:
+                runs = list(executor.map(run, range(n_init)))
+            # Keep the run of the lowest inertia
+            (
+                self.inertia,
+                self.centers,
+                self.y_pred,
+                self.centroids_idxs,
+            ) = min(runs, key=lambda run: run[0])
+        elif method == "minibatch":
+            # A single streaming fit, unless already fitted on the fly
+            if minibatch is None:
+                minibatch = MiniBatchKMeans(n_clusters, seed=0).fit(X)
+            self.y_pred = minibatch.predict(X)
+            self.centers = minibatch.centers
+            self.centroids_idxs, self.inertia = medoids(
+                X, self.y_pred, self.centers
+            )
         elif method == "sklearn":
             km = KMeans(n_clusters, n_init=n_init)
             self.y_pred = km.fit_predict(X)
             self.centers = km.cluster_centers_
-            self.centroids_idxs = km.transform(X).argmin(axis=0)
+            self.centroids_idxs, self.inertia = medoids(
+                X, self.y_pred, self.centers
+            )
+        else:
+            raise NotImplementedError
+
+    @classmethod
+    def from_result(cls, X, centers, y_pred):
+        """Wrap a clustering computed elsewhere
+
+        Parameters
+        ----------
+        X: numpy.ndarray
+            Clustered samples of shape (n_samples, n_features)
+        centers: numpy.ndarray
+            Cluster centres of shape (n_clusters, n_features)
+        y_pred: numpy.ndarray
+            Cluster of each sample
+
+        Returns
+        -------
+        KMeansWrapper
+            The clustering with its medoids and inertia
+        """
+        km = cls.__new__(cls)
+        km.centers = centers
+        km.y_pred = y_pred
+        km.centroids_idxs, km.inertia = medoids(X, y_pred, centers)
+        return km
+
+    @classmethod
+    def sweep(cls, X, n_clusters, seed=0, **params):
+        """Cluster `X` for several numbers of clusters, each run being
+        warm-started from the previous one
+
+        Parameters
+        ----------
+        X: numpy.ndarray
+            Samples of shape (n_samples, n_features)
+        n_clusters: list of int
+            Numbers of clusters
+        seed: int or None
+            Random seed
+        **params:
+            Parameters to be passed to `kmeans`
+
+        Returns
+        -------
+        dict
+            KMeansWrapper of each number of clusters
+        """
+        return {
+            k: cls.from_result(X, centers, y_pred)
+            for k, (centers, y_pred) in kmeans_sweep(
+                X, n_clusters, seed=seed, **params
+            ).items()
+        }
+
+    @classmethod
+    def partitioned(
+        cls,
+        X,
+        labels,
+        n_clusters,
+        n_init=3,
+        method="kmcuda",
+        allocation="proportional",
+        n_jobs=None,
+    ):
+        """Cluster each class separately, then merge the clusterings
+
+        Each class is gathered into memory in the dtype of `X` while it is
+        clustered.
+
+        Parameters
+        ----------
+        X: numpy.ndarray
+            Samples of shape (n_samples, n_features)
+        labels: numpy.ndarray
+            Label of each sample
+        n_clusters: int
+            Total number of clusters
+        n_init: int
+            Number of restarts of each class
+        method: str
+            k-Means backend
+        allocation: str
+            "proportional" to allocate clusters in proportion to the
+            number of samples of each class, or "variance" in proportion
+            to the total squared deviation of each class from its mean
+        n_jobs: int or None
+            Number of classes clustered concurrently. Defaults to one per
+            class. The CPUs are split evenly across them
+
+        Returns
+        -------
+        KMeansWrapper
+            The merged clustering, whose clusters never mix labels
+        """
+        labels = np.asarray(labels)
+        classes = np.unique(labels)
+        idxs = [np.flatnonzero(labels == c) for c in classes]
+        if allocation == "proportional":
+            weights = np.array([len(idx) for idx in idxs], dtype=float)
+        elif allocation == "variance":
+            # Total squared deviation, sum |x|^2 - n |mean|^2, without a
+            # float64 copy of the class
+            weights = np.array(
+                [
+                    row_norms(X[idx]).sum(dtype=np.float64)
+                    - len(idx)
+                    * np.sum(np.square(X[idx].mean(axis=0, dtype=np.float64)))
+                    for idx in idxs
+                ]
+            )
         else:
             raise NotImplementedError
+        sizes = allocate_clusters(
+            weights, n_clusters, [len(idx) for idx in idxs]
+        )
+
+        n_workers = min(n_jobs or len(classes), len(classes))
+        n_threads = max(1, os.cpu_count() // n_workers)
+
+        def fit(i):
+            return cls(
+                X[idxs[i]],
+                sizes[i],
+                n_init,
+                method,
+                n_jobs=1,
+                n_threads=n_threads,
+            )
+
+        with ThreadPoolExecutor(n_workers) as executor:
+            fits = list(executor.map(fit, range(len(classes))))
+
+        # Offset the cluster ids of each class, and map its medoids back to
+        # indices into X
+        km = cls.__new__(cls)
+        km.y_pred = np.empty(len(X), dtype=int)
+        offset = 0
+        for idx, class_km in zip(idxs, fits):
+            km.y_pred[idx] = np.asarray(class_km.y_pred) + offset
+            offset += len(class_km.centers)
+        km.centers = np.concatenate([class_km.centers for class_km in fits])
+        km.centroids_idxs = np.concatenate(
+            [idx[class_km.centroids_idxs] for idx, class_km in zip(idxs, fits)]
+        )
+        km.inertia = sum(class_km.inertia for class_km in fits)
+        return km
+
+
+def dataset_targets(dataset):
+    """Labels of every sample of a dataset, as a NumPy array"""
+    if hasattr(dataset, "targets"):
+        targets = dataset.targets
+    elif hasattr(dataset, "tensors"):
+        targets = dataset.tensors[1]
+    else:
+        targets = torch.cat(
+            [y for _, y in DataLoader(dataset, batch_size=1024)]
+        )
+    if isinstance(targets, torch.Tensor):
+        targets = targets.cpu().numpy()
+    return np.asarray(targets)
 
 
 def count_unique(keys):
@@ -72,6 +305,16 @@ class AdversarialDataset(Dataset):
         n_init=3,
         transform=None,
         device="cuda",
+        cache=None,
+        tensor_backed=False,
+        feature_batch_size=64,
+        feature_dtype=np.float32,
+        feature_out=None,
+        reduction=None,
+        n_components=64,
+        km=None,
+        store=None,
+        partition_by=None,
     ):
         # Initialise things
         super().__init__()
@@ -79,85 +322,125 @@ class AdversarialDataset(Dataset):
         self.dataset = dataset
         self.criterion = criterion
         self.transform = transform
+        self.tensor_backed = tensor_backed
 
-        # Create a k-Means instance and fit
-        if cluster_with == "fgsm_perturb":
-            dl = DataLoader(dataset, batch_size=64, shuffle=False)
-            d = []
-            for images, labels in iter(dl):
-                y = (
-                    fgsm_perturbs(
-                        model,
-                        criterion,
-                        images,
-                        labels,
-                        epsilon=epsilon,
-                        device=device,
-                    )
-                    .detach()
-                    .cpu()
-                    .reshape(len(images), -1)
-                    .numpy()
+        self.reducer = None
+        key = None
+        if km is None and store is not None:
+            key = store.key(
+                model,
+                dataset,
+                cluster_with,
+                n_clusters,
+                epsilon=epsilon,
+                criterion=criterion,
+                method=method,
+                n_init=n_init,
+                feature_dtype=np.dtype(feature_dtype).name,
+                reduction=reduction,
+                n_components=n_components,
+                partition_by=partition_by,
+            )
+            stored = store.load(key)
+            if stored is not None:
+                km, self.reducer = stored
+
+        if km is not None:
+            # Already clustered, e.g. by `KMeansWrapper.sweep` or stored
+            self.km = km
+        else:
+            # Create a k-Means instance and fit
+            minibatch = None
+            if (
+                method == "minibatch"
+                and cluster_with in FEATURES
+                and reduction is None
+                and partition_by is None
+            ):
+                # Fit while the features are being computed or read
+                minibatch = MiniBatchKMeans(n_clusters, seed=0)
+            perturb_attacks = {"fgsm_perturb": "fgsm", "pgd_perturb": "pgd"}
+            if cache is not None and cluster_with in perturb_attacks:
+                perturbs = cache.perturbs(
+                    model,
+                    dataset,
+                    perturb_attacks[cluster_with],
+                    criterion=criterion,
+                    batch_size=feature_batch_size,
+                    device=device,
+                    epsilon=epsilon,
                 )
-                d.append(y)
-            d = np.concatenate(d)
-        elif cluster_with == "fgsm_input":
-            dl = DataLoader(dataset, batch_size=64, shuffle=False)
-            d = []
-            for images, labels in iter(dl):
-                y = (
-                    fgsm(model, criterion, images, labels, device=device)
-                    .detach()
-                    .cpu()
-                    .reshape(len(images), -1)
-                    .numpy()
+                # Unpacked one batch at a time, as for fresh features
+                batches = (
+                    perturbs[start : start + feature_batch_size]
+                    for start in range(0, len(dataset), feature_batch_size)
                 )
-                d.append(y)
-            d = np.concatenate(d)
-        elif cluster_with == "pgd_perturb":
-            dl = DataLoader(dataset, batch_size=64, shuffle=False)
-            d = []
-            for images, labels in iter(dl):
-                y = (
-                    pgd_perturbs(
-                        model,
-                        criterion,
-                        images,
-                        labels,
-                        epsilon=epsilon,
-                        device=device,
-                    )
-                    .detach()
-                    .cpu()
-                    .reshape(len(images), -1)
-                    .numpy()
+                d = stack_features(
+                    (batch.reshape(len(batch), -1) for batch in batches),
+                    len(dataset),
+                    dtype=feature_dtype,
+                    out=feature_out,
+                    callback=(
+                        None if minibatch is None else minibatch.partial_fit
+                    ),
                 )
-                d.append(y)
-            d = np.concatenate(d)
-        elif cluster_with == "pgd_input":
-            dl = DataLoader(dataset, batch_size=64, shuffle=False)
-            d = []
-            for images, labels in iter(dl):
-                y = (
-                    pgd(model, criterion, images, labels, device=device)
-                    .detach()
-                    .cpu()
-                    .reshape(len(images), -1)
-                    .numpy()
+            elif cluster_with in FEATURES:
+                d = extract_features(
+                    model,
+                    dataset,
+                    cluster_with,
+                    criterion=criterion,
+                    epsilon=epsilon,
+                    batch_size=feature_batch_size,
+                    dtype=feature_dtype,
+                    out=feature_out,
+                    device=device,
+                    callback=(
+                        None if minibatch is None else minibatch.partial_fit
+                    ),
                 )
-                d.append(y)
-            d = np.concatenate(d)
-        elif cluster_with == "original_data":
-            d = self.dataset.data.reshape(len(dataset), -1)
-            if type(d) is not np.ndarray:
-                d = d.detach().cpu().numpy()
-        else:
-            raise NotImplementedError
-        self.km = KMeansWrapper(d, n_clusters, n_init, method)
+            elif cluster_with == "original_data":
+                d = self.dataset.data.reshape(len(dataset), -1)
+                if type(d) is not np.ndarray:
+                    d = d.detach().cpu().numpy()
+            else:
+                raise NotImplementedError
+
+            # Cluster in a reduced space. Rows keep their order, so the
+            # medoids are still indices into the raw dataset
+            if reduction is not None:
+                d, self.reducer = reduce_features(
+                    d, reduction, n_components=n_components
+                )
+            if partition_by == "label":
+                self.km = KMeansWrapper.partitioned(
+                    d, dataset_targets(dataset), n_clusters, n_init, method
+                )
+            elif partition_by is None:
+                self.km = KMeansWrapper(
+                    d, n_clusters, n_init, method, minibatch
+                )
+            else:
+                raise NotImplementedError
+            if key is not None:
+                store.save(key, self.km, self.reducer)
         # Obtain targets and ids of each cluster centres
         self.cluster_ids = self.km.y_pred.astype(int)
         self.cluster_centers_idx = self.km.centroids_idxs.astype(int)
 
+        if tensor_backed:
+            # Transform the whole dataset once and serve batches from memory
+            self.data, self.targets = materialize(dataset, device=device)
+            self.cluster_ids = torch.from_numpy(self.cluster_ids).to(
+                self.data.device
+            )
+            centers_idx = torch.from_numpy(self.cluster_centers_idx).to(
+                self.data.device
+            )
+            self.centroids_X = self.data[centers_idx]
+            self.centroids_y = self.targets[centers_idx]
+            return
+
         # Extract only interested ones
         X = []
         y = []
@@ -176,10 +459,85 @@ class AdversarialDataset(Dataset):
         return len(self.dataset)
 
     def __getitem__(self, idx):
+        if self.tensor_backed:
+            # `idx` may be a whole batch of indices
+            return self.data[idx], self.targets[idx], self.cluster_ids[idx]
         image, target = self.dataset[idx]
         cluster_id = self.cluster_ids[idx]
         return image, target, cluster_id
 
+    def loader(self, batch_size=128, shuffle=False, batch_sampler=None):
+        """DataLoader over the dataset
+
+        In tensor-backed mode, each batch is gathered from the materialised
+        tensors with a single indexing operation instead of being collated
+        sample by sample.
+
+        Parameters
+        ----------
+        batch_size: int
+            Batch size
+        shuffle: bool
+            Whether to shuffle the samples
+        batch_sampler: torch.utils.data.Sampler or None
+            If given, sampler yielding the indices of each batch, e.g. a
+            `ClusterBatchSampler`. `batch_size` and `shuffle` are then
+            ignored
+
+        Returns
+        -------
+        torch.utils.data.DataLoader
+            DataLoader yielding (images, targets, cluster ids)
+        """
+        if batch_sampler is None:
+            if not self.tensor_backed:
+                return DataLoader(self, batch_size=batch_size, shuffle=shuffle)
+            sampler = (
+                RandomSampler(self) if shuffle else SequentialSampler(self)
+            )
+            batch_sampler = BatchSampler(sampler, batch_size, drop_last=False)
+        if not self.tensor_backed:
+            return DataLoader(self, batch_sampler=batch_sampler)
+        return DataLoader(self, batch_size=None, sampler=batch_sampler)
+
+
+def materialize(dataset, batch_size=1024, device=None):
+    """Transform a whole dataset once into contiguous tensors
+
+    The transform of the dataset runs only once per sample, here, so any
+    random augmentation is drawn once and then fixed for the whole run.
+
+    Parameters
+    ----------
+    dataset: torch.utils.data.Dataset
+        Dataset yielding (image, target) pairs
+    batch_size: int
+        Number of samples transformed at a time
+    device: torch.device, str, or None
+        Device on which the tensors are stored
+
+    Returns
+    -------
+    (torch.Tensor, torch.Tensor)
+        Images and targets of the whole dataset
+    """
+    data = None
+    offset = 0
+    for images, targets in DataLoader(dataset, batch_size=batch_size):
+        if data is None:
+            data = torch.empty(
+                (len(dataset),) + tuple(images.shape[1:]),
+                dtype=images.dtype,
+                device=device,
+            )
+            all_targets = torch.empty(
+                len(dataset), dtype=torch.long, device=device
+            )
+        data[offset : offset + len(images)] = images
+        all_targets[offset : offset + len(images)] = targets
+        offset += len(images)
+    return data, all_targets
+
 
 def cluster_training(
     model,
@@ -196,6 +554,18 @@ def cluster_training(
     pgd_parameters={"n_epoches": 7},
     device=None,
     log=None,
+    cache=None,
+    refresh="full",
+    refresh_fraction=0.2,
+    refresh_max_age=5,
+    tensor_backed=False,
+    reduction=None,
+    n_components=64,
+    km=None,
+    store=None,
+    partition_by=None,
+    batching="sequential",
+    centroid_cache_size=64,
 ):
     if log is not None:
         log.info(f"k-Means started at: {get_time()}")
@@ -211,8 +581,27 @@ def cluster_training(
         n_init=n_init,
         transform=trainloader.dataset.transform,
         device=device,
+        cache=cache,
+        tensor_backed=tensor_backed,
+        reduction=reduction,
+        n_components=n_components,
+        km=km,
+        store=store,
+        partition_by=partition_by,
     )
-    adversarialloader = DataLoader(adversarial_dataset, batch_size=128)
+    if batching == "cluster":
+        # Batches of a few clusters each, whose centroids are attacked lazily
+        if refresh != "full":
+            raise ValueError('batching="cluster" requires refresh="full"')
+        adversarialloader = adversarial_dataset.loader(
+            batch_sampler=ClusterBatchSampler(
+                adversarial_dataset.cluster_ids, batch_size=128
+            )
+        )
+    elif batching == "sequential":
+        adversarialloader = adversarial_dataset.loader(batch_size=128)
+    else:
+        raise NotImplementedError
     if log is not None:
         kmeans_end = datetime.now()
         kmeans_time = delta_time_string(kmeans_end, kmeans_start)
@@ -227,9 +616,33 @@ def cluster_training(
     # Create an optimiser instance
     optimizer = optimizer(model.parameters(), **optimizer_params)
 
+    centroids_X = adversarial_dataset.centroids_X
+    centroids_y = adversarial_dataset.centroids_y
     if device is not None:
-        centroids_X = adversarial_dataset.centroids_X.to(device)
-        centroids_y = adversarial_dataset.centroids_y.to(device)
+        centroids_X = centroids_X.to(device)
+        centroids_y = centroids_y.to(device)
+
+    if batching == "cluster":
+        lazy_perturbs = LazyCentroidPerturbs(
+            centroids_X,
+            centroids_y,
+            criterion=criterion,
+            epsilon=epsilon,
+            pgd_parameters=pgd_parameters,
+            max_size=centroid_cache_size,
+        )
+    elif refresh == "stale":
+        refresher = CentroidRefresher(
+            centroids_X,
+            centroids_y,
+            criterion=criterion,
+            epsilon=epsilon,
+            pgd_parameters=pgd_parameters,
+            refresh_fraction=refresh_fraction,
+            max_age=refresh_max_age,
+        )
+    elif refresh != "full":
+        raise NotImplementedError
 
     # Iterate over e times of epoches
     for e in range(n_epoches):
@@ -237,14 +650,20 @@ def cluster_training(
         if log is not None:
             pgd_start = datetime.now()
         # Generate PGD examples
-        cluster_perturbs = pgd_perturbs(
-            model,
-            criterion,
-            centroids_X,
-            centroids_y,
-            epsilon=epsilon,
-            **pgd_parameters,
-        )
+        if batching == "cluster":
+            # Attacked batch by batch within the epoch
+            lazy_perturbs.clear()
+        elif refresh == "stale":
+            cluster_perturbs = refresher.refresh(model)
+        else:
+            cluster_perturbs = pgd_perturbs(
+                model,
+                criterion,
+                centroids_X,
+                centroids_y,
+                epsilon=epsilon,
+                **pgd_parameters,
+            )
         if log is not None:
             pgd_end = datetime.now()
             pgd_time = delta_time_string(pgd_end, pgd_start)
@@ -263,13 +682,18 @@ def cluster_training(
             if device is not None:
                 images = images.to(device)
                 labels = labels.to(device)
-                cluster_perturbs = cluster_perturbs.to(device)
+                if batching != "cluster":
+                    cluster_perturbs = cluster_perturbs.to(device)
             optimizer.zero_grad()
 
             calc_input_timestamp = datetime.now()
-            X_input = images + cluster_perturbs[cluster_idx.numpy()].reshape(
-                images.shape
-            )
+            if batching == "cluster":
+                perturbs = lazy_perturbs.perturbs(model, cluster_idx)
+            else:
+                perturbs = cluster_perturbs[
+                    cluster_idx.to(cluster_perturbs.device)
+                ]
+            X_input = images + perturbs.reshape(images.shape)
             input_timestamp = datetime.now()
             output = model(X_input)
             backprop_timestamp = datetime.now()
@@ -0,0 +1,215 @@
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from clustre.attacking import (
+    attack_stream,
+    fgsm,
+    fgsm_perturbs,
+    pgd,
+    pgd_perturbs,
+)
+
+
+def embeddings(model, criterion, images, labels, device=None, **params):
+    """Penultimate-layer activations of a batch
+
+    The input of the last `nn.Linear` of the model is captured with a
+    forward pre-hook during one gradient-free forward pass. The signature
+    is that of `fgsm_perturbs`, and the criterion and labels are unused.
+
+    Returns
+    -------
+    torch.Tensor
+        Activations of shape (batch_size, n_features)
+    """
+    linears = [m for m in model.modules() if isinstance(m, nn.Linear)]
+    if not linears:
+        raise ValueError("The model has no nn.Linear layer")
+
+    model.eval()
+    if device is not None:
+        model.to(device)
+        images = images.to(device)
+
+    captured = []
+    handle = linears[-1].register_forward_pre_hook(
+        lambda module, inputs: captured.append(inputs[0])
+    )
+    try:
+        with torch.no_grad():
+            model(images)
+    finally:
+        handle.remove()
+    return captured[0]
+
+
+# Functions computing the clustering features of a batch, with the
+# signature of `fgsm_perturbs`
+FEATURES = {
+    "fgsm_perturb": fgsm_perturbs,
+    "fgsm_input": fgsm,
+    "pgd_perturb": pgd_perturbs,
+    "pgd_input": pgd,
+    "embedding": embeddings,
+}
+
+
+def iter_features(
+    model,
+    dataset,
+    cluster_with,
+    criterion=nn.CrossEntropyLoss(),
+    epsilon=0.3,
+    batch_size=64,
+    device=None,
+):
+    """Compute the clustering features of a dataset batch by batch
+
+    Parameters
+    ----------
+    model: torch.nn.model
+        The model to be attacked
+    dataset: torch.utils.data.Dataset
+        Dataset to be clustered
+    cluster_with: str
+        A key of `FEATURES`
+    criterion: function
+        Criterion function
+    epsilon: float
+        Perturbation bound of the attack
+    batch_size: int
+        Batch size of the attack
+    device: torch.device, str, or None
+        Device to be used
+
+    Yields
+    ------
+    torch.Tensor
+        Flattened features of each batch, in dataset order
+    """
+    if cluster_with not in FEATURES:
+        raise NotImplementedError
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    for features in attack_stream(
+        model,
+        loader,
+        FEATURES[cluster_with],
+        criterion=criterion,
+        device=device,
+        epsilon=epsilon,
+    ):
+        yield features.reshape(len(features), -1)
+
+
+def extract_features(
+    model,
+    dataset,
+    cluster_with,
+    criterion=nn.CrossEntropyLoss(),
+    epsilon=0.3,
+    batch_size=64,
+    dtype=np.float32,
+    out=None,
+    device=None,
+    callback=None,
+):
+    """Compute the clustering features of a whole dataset
+
+    Each batch is written in place into a matrix preallocated for the whole
+    dataset, so the features are never held twice.
+
+    Parameters
+    ----------
+    model: torch.nn.model
+        The model to be attacked
+    dataset: torch.utils.data.Dataset
+        Dataset to be clustered
+    cluster_with: str
+        A key of `FEATURES`
+    criterion: function
+        Criterion function
+    epsilon: float
+        Perturbation bound of the attack
+    batch_size: int
+        Batch size of the attack
+    dtype: numpy.dtype
+        Data type of the features, e.g. `np.float32` or `np.float16`
+    out: str or None
+        If given, path of a `.npy` file into which the features are
+        memory-mapped. The "cpu", "hierarchical" and "minibatch" k-means
+        backends read the features chunk by chunk in their own dtype,
+        while "kmcuda" and "sklearn" copy them into memory as float32 or
+        float64
+    device: torch.device, str, or None
+        Device to be used
+    callback: function or None
+        If given, called with the features of every batch as they are
+        computed, e.g. `MiniBatchKMeans.partial_fit`
+
+    Returns
+    -------
+    numpy.ndarray
+        Features of shape (n_samples, n_features)
+    """
+    batches = iter_features(
+        model,
+        dataset,
+        cluster_with,
+        criterion=criterion,
+        epsilon=epsilon,
+        batch_size=batch_size,
+        device=device,
+    )
+    return stack_features(
+        (batch.cpu().numpy() for batch in batches),
+        len(dataset),
+        dtype=dtype,
+        out=out,
+        callback=callback,
+    )
+
+
+def stack_features(
+    batches, n_samples, dtype=np.float32, out=None, callback=None
+):
+    """Write batches of features in place into one matrix
+
+    Parameters
+    ----------
+    batches: iterable of numpy.ndarray
+        Flattened features of consecutive batches
+    n_samples: int
+        Total number of samples
+    dtype: numpy.dtype
+        Data type of the features
+    out: str or None
+        If given, path of a `.npy` file into which the features are
+        memory-mapped
+    callback: function or None
+        If given, called with the features of every batch
+
+    Returns
+    -------
+    numpy.ndarray
+        Features of shape (n_samples, n_features)
+    """
+    features = None
+    offset = 0
+    for batch in batches:
+        if features is None:
+            shape = (n_samples, batch.shape[1])
+            if out is None:
+                features = np.empty(shape, dtype=dtype)
+            else:
+                features = np.lib.format.open_memmap(
+                    out, mode="w+", dtype=dtype, shape=shape
+                )
+        features[offset : offset + len(batch)] = batch
+        if callback is not None:
+            callback(features[offset : offset + len(batch)])
+        offset += len(batch)
+    if out is not None:
+        features.flush()
+    return features
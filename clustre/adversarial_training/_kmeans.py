@@ -0,0 +1,637 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+
+def medoids(X, y_pred, centers, chunk_size=4096):
+    """Find the sample nearest to each cluster centre within its cluster
+
+    Only the distance of every sample to its own centre is computed, in
+    chunks of `chunk_size` samples, so memory stays O(N) however many
+    clusters there are.
+
+    Parameters
+    ----------
+    X: numpy.ndarray
+        Samples of shape (n_samples, n_features)
+    y_pred: numpy.ndarray
+        Cluster of each sample
+    centers: numpy.ndarray
+        Cluster centres of shape (n_clusters, n_features)
+    chunk_size: int
+        Number of samples whose distances are computed at a time
+
+    Returns
+    -------
+    (numpy.ndarray, float)
+        Index of the medoid of each cluster, 0 for empty clusters, and the
+        sum of the distances of the samples to their centres
+    """
+    y_pred = np.asarray(y_pred)
+    centers = np.asarray(centers, dtype=np.float32)
+    norms = np.empty(len(X), dtype=np.float32)
+    for start in range(0, len(X), chunk_size):
+        end = start + chunk_size
+        diff = np.array(X[start:end], dtype=np.float32)
+        diff -= centers[y_pred[start:end]]
+        norms[start:end] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+    # Sort by cluster, then by distance: the first sample of each segment is
+    # the medoid of its cluster
+    order = np.lexsort((norms, y_pred))
+    labels = y_pred[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = labels[1:] != labels[:-1]
+
+    centroids_idxs = np.zeros(len(centers), dtype=int)
+    centroids_idxs[labels[first]] = order[first]
+    return centroids_idxs, float(norms.sum(dtype=np.float64))
+
+
+def kmeans(
+    X,
+    n_clusters,
+    init="k-means||",
+    max_iter=100,
+    tol=1e-4,
+    seed=None,
+    chunk_size=1024,
+    n_threads=None,
+    x_norms=None,
+):
+    """Lloyd's k-means on CPU with blocked BLAS distances
+
+    Squared distances are computed as |x|^2 - 2 x.c + |c|^2, one chunk of
+    `chunk_size` samples against all centres at a time, so memory stays
+    O(chunk_size * n_clusters) per thread. Chunks are processed
+    concurrently by `n_threads` threads.
+
+    Parameters
+    ----------
+    X: numpy.ndarray
+        Samples of shape (n_samples, n_features)
+    n_clusters: int
+        Number of clusters
+    init: str or numpy.ndarray
+        "k-means||" for scalable k-means++ seeding, "k-means++" for
+        sequential k-means++ seeding, "random", or the initial centres
+    max_iter: int
+        Maximum number of Lloyd iterations
+    tol: float
+        Stop when the centres move by less than `tol` times the mean
+        variance of the features
+    seed: int or None
+        Random seed
+    chunk_size: int
+        Number of samples whose distances are computed at a time
+    n_threads: int or None
+        Number of threads. Defaults to the number of CPUs
+    x_norms: numpy.ndarray or None
+        Precomputed squared norms of the samples, see `row_norms`
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        Centres of shape (n_clusters, n_features) and cluster of each sample
+    """
+    rng = np.random.RandomState(seed)
+    with ThreadPoolExecutor(n_threads or os.cpu_count()) as executor:
+        if x_norms is None:
+            x_norms = row_norms(X, chunk_size)
+        if isinstance(init, np.ndarray):
+            centers = np.array(init, dtype=np.float32)
+        elif init == "k-means||":
+            centers = _init_kmeans_parallel(
+                X, n_clusters, x_norms, rng, chunk_size, executor
+            )
+        elif init == "k-means++":
+            centers = _init_kmeans_plusplus(X, n_clusters, x_norms, rng)
+        elif init == "random":
+            idx = rng.choice(len(X), n_clusters, replace=False)
+            centers = np.array(X[np.sort(idx)], dtype=np.float32)
+        else:
+            raise NotImplementedError
+
+        variance = x_norms.mean() - np.sum(
+            np.square(np.mean(X, axis=0, dtype=np.float64))
+        )
+        threshold = tol * variance / X.shape[1]
+        for _ in range(max_iter):
+            y_pred, distances = assign(
+                X, centers, x_norms, chunk_size, executor
+            )
+            new_centers = _update_centers(
+                X, y_pred, distances, n_clusters, chunk_size
+            )
+            shift = np.sum(np.square(new_centers - centers))
+            centers = new_centers
+            if shift <= threshold:
+                break
+        y_pred, _ = assign(X, centers, x_norms, chunk_size, executor)
+    return centers, y_pred
+
+
+def kmeans_sweep(
+    X,
+    n_clusters,
+    growth=1.25,
+    grow_iter=5,
+    max_iter=100,
+    seed=None,
+    chunk_size=1024,
+    **params,
+):
+    """k-means for several numbers of clusters, warm-started in turn
+
+    The numbers of clusters are solved in increasing order. Each solution
+    grows from the previous one by at most a factor `growth` at a time:
+    the clusters of the largest squared error are split in two, and the
+    centres are refined by `grow_iter` Lloyd iterations before the next
+    growth step. The row norms of `X` are computed once and shared by every
+    run.
+
+    Parameters
+    ----------
+    X: numpy.ndarray
+        Samples of shape (n_samples, n_features)
+    n_clusters: list of int
+        Numbers of clusters
+    growth: float
+        Maximum growth factor of the number of clusters per step
+    grow_iter: int
+        Lloyd iterations at the intermediate numbers of clusters
+    max_iter: int
+        Maximum number of Lloyd iterations at each requested number of
+        clusters
+    seed: int or None
+        Random seed
+    chunk_size: int
+        Number of samples whose distances are computed at a time
+    **params:
+        Parameters to be passed to `kmeans`
+
+    Returns
+    -------
+    dict
+        Centres and cluster of each sample, keyed by number of clusters
+    """
+    rng = np.random.RandomState(seed)
+    x_norms = row_norms(X, chunk_size)
+    results = {}
+    centers = None
+    for k in sorted(n_clusters):
+        if centers is None:
+            centers, y_pred = kmeans(
+                X,
+                k,
+                max_iter=max_iter,
+                seed=seed,
+                chunk_size=chunk_size,
+                x_norms=x_norms,
+                **params,
+            )
+        while len(centers) < k:
+            size = min(k, max(len(centers) + 1, int(len(centers) * growth)))
+            init = _split_centers(
+                X, centers, size - len(centers), x_norms, rng, chunk_size
+            )
+            centers, y_pred = kmeans(
+                X,
+                size,
+                init=init,
+                max_iter=max_iter if size == k else grow_iter,
+                chunk_size=chunk_size,
+                x_norms=x_norms,
+                **params,
+            )
+        results[k] = centers, y_pred
+    return results
+
+
+def _split_centers(X, centers, n_new, x_norms, rng, chunk_size, alpha=0.3):
+    # Split the `n_new` clusters of the largest squared error. The two
+    # halves move apart along the direction of a member sampled with
+    # probability proportional to its squared distance to the centre
+    y_pred, distances = assign(X, centers, x_norms, chunk_size)
+    sse = np.bincount(y_pred, weights=distances, minlength=len(centers))
+    picked = np.argsort(sse)[::-1][:n_new]
+
+    # Weighted sampling of one member per cluster: the smallest
+    # exponential key divided by the weight wins
+    with np.errstate(divide="ignore"):
+        keys = rng.exponential(size=len(X)) / distances
+    order = np.lexsort((keys, y_pred))
+    labels = y_pred[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = labels[1:] != labels[:-1]
+    members = np.zeros(len(centers), dtype=int)
+    members[labels[first]] = order[first]
+
+    centers = np.array(centers, dtype=np.float32)
+    delta = alpha * (np.asarray(X[members[picked]]) - centers[picked])
+    centers[picked] -= delta
+    return np.concatenate([centers, centers[picked] + 2 * delta])
+
+
+def allocate_clusters(weights, n_clusters, max_sizes=None):
+    """Split `n_clusters` in proportion to `weights` by largest remainder
+
+    Every part gets at least one cluster, and at most its `max_sizes`.
+    """
+    weights = np.asarray(weights, dtype=float)
+    if max_sizes is None:
+        max_sizes = np.full(len(weights), n_clusters)
+    max_sizes = np.asarray(max_sizes)
+    if not len(weights) <= n_clusters <= max_sizes.sum():
+        raise ValueError(
+            f"Cannot split {n_clusters} clusters into {len(weights)} parts"
+        )
+
+    if weights.sum() == 0:
+        weights = np.ones(len(weights))
+    quotas = n_clusters * weights / weights.sum()
+    sizes = np.clip(np.floor(quotas).astype(int), 1, max_sizes)
+    # Move one cluster at a time to or from the part furthest from its quota
+    while sizes.sum() < n_clusters:
+        deficit = np.where(sizes < max_sizes, quotas - sizes, -np.inf)
+        sizes[deficit.argmax()] += 1
+    while sizes.sum() > n_clusters:
+        surplus = np.where(sizes > 1, sizes - quotas, -np.inf)
+        sizes[surplus.argmax()] -= 1
+    return sizes
+
+
+def hierarchical_kmeans(
+    X, n_clusters, branching=None, seed=None, n_threads=None, **params
+):
+    """Hierarchical k-means, refining coarse clusters into finer ones
+
+    `X` is first split into `branching` coarse clusters. The
+    `n_clusters` are allocated to the coarse clusters in proportion to
+    their sizes, and each coarse cluster is split again the same way,
+    until each cell needs at most `branching` clusters. Every level costs
+    O(N * branching * n_features), so the total cost scales with
+    N * n_features * branching * log(n_clusters) / log(branching) instead
+    of N * n_features * n_clusters. The coarse cells are refined
+    concurrently.
+
+    Parameters
+    ----------
+    X: numpy.ndarray
+        Samples of shape (n_samples, n_features)
+    n_clusters: int
+        Number of clusters
+    branching: int or None
+        Number of children of each cell. Defaults to sqrt(n_clusters), for
+        two levels
+    seed: int or None
+        Random seed
+    n_threads: int or None
+        Number of coarse cells refined concurrently. Defaults to the
+        number of CPUs
+    **params:
+        Parameters to be passed to `kmeans`
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        Centres of shape (n_clusters, n_features) and cluster of each sample
+    """
+    if branching is None:
+        branching = max(2, int(np.ceil(np.sqrt(n_clusters))))
+    centers = np.empty((n_clusters, X.shape[1]), dtype=np.float32)
+    y_pred = np.empty(len(X), dtype=int)
+
+    def split(idx, k):
+        # Split the cell `idx` into `k` children, or into `branching`
+        # coarser children with their share of the `k` clusters
+        n_children = min(k, branching)
+        if len(idx) == n_children:
+            return np.asarray(X[idx], dtype=np.float32), np.arange(len(idx))
+        # The root cell is X itself, finer cells are gathered in X's dtype
+        cell = X if len(idx) == len(X) else X[idx]
+        return kmeans(cell, n_children, seed=seed, n_threads=1, **params)
+
+    def solve(idx, k, offset):
+        # Cluster the cell `idx` into the clusters offset..offset + k - 1
+        if k == 1:
+            centers[offset] = X[idx].mean(axis=0, dtype=np.float64)
+            y_pred[idx] = offset
+            return []
+        cell_centers, cell_y = split(idx, k)
+        if k <= branching:
+            centers[offset : offset + k] = cell_centers
+            y_pred[idx] = cell_y + offset
+            return []
+        children = [idx[cell_y == i] for i in range(len(cell_centers))]
+        children = [child for child in children if len(child) != 0]
+        sizes = allocate_clusters(
+            [len(child) for child in children],
+            k,
+            [len(child) for child in children],
+        )
+        offsets = offset + np.cumsum(sizes) - sizes
+        return list(zip(children, sizes, offsets))
+
+    def solve_all(idx, k, offset):
+        cells = [(idx, k, offset)]
+        while cells:
+            cells.extend(solve(*cells.pop()))
+
+    coarse = solve(np.arange(len(X)), n_clusters, 0)
+    with ThreadPoolExecutor(n_threads or os.cpu_count()) as executor:
+        list(executor.map(lambda cell: solve_all(*cell), coarse))
+    return centers, y_pred
+
+
+def row_norms(X, chunk_size=1024):
+    """Squared norm of every row of `X`, computed in chunks"""
+    norms = np.empty(len(X), dtype=np.float32)
+    for start in range(0, len(X), chunk_size):
+        x = np.asarray(X[start : start + chunk_size], dtype=np.float32)
+        norms[start : start + chunk_size] = np.einsum("ij,ij->i", x, x)
+    return norms
+
+
+def assign(X, centers, x_norms=None, chunk_size=1024, executor=None):
+    """Nearest centre of every sample
+
+    Parameters
+    ----------
+    X: numpy.ndarray
+        Samples of shape (n_samples, n_features)
+    centers: numpy.ndarray
+        Centres of shape (n_clusters, n_features)
+    x_norms: numpy.ndarray or None
+        Precomputed squared norms of the samples
+    chunk_size: int
+        Number of samples whose distances are computed at a time
+    executor: concurrent.futures.Executor or None
+        If given, chunks are processed by the executor
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        Nearest centre of every sample, and its squared distance
+    """
+    if x_norms is None:
+        x_norms = row_norms(X, chunk_size)
+    centers = np.asarray(centers, dtype=np.float32)
+    c_norms = np.einsum("ij,ij->i", centers, centers)
+    y_pred = np.empty(len(X), dtype=int)
+    distances = np.empty(len(X), dtype=np.float32)
+
+    def assign_chunk(start):
+        end = start + chunk_size
+        x = np.asarray(X[start:end], dtype=np.float32)
+        d = x @ centers.T
+        d *= -2
+        d += c_norms
+        y = d.argmin(axis=1)
+        y_pred[start:end] = y
+        distances[start:end] = np.maximum(
+            d[np.arange(len(y)), y] + x_norms[start:end], 0
+        )
+
+    starts = range(0, len(X), chunk_size)
+    if executor is None:
+        for start in starts:
+            assign_chunk(start)
+    else:
+        list(executor.map(assign_chunk, starts))
+    return y_pred, distances
+
+
+def _dot(X, C, chunk_size=1024):
+    """X @ C.T in float32, converting `X` one chunk at a time"""
+    C = np.asarray(C, dtype=np.float32)
+    out = np.empty((len(X), len(C)), dtype=np.float32)
+    for start in range(0, len(X), chunk_size):
+        x = np.asarray(X[start : start + chunk_size], dtype=np.float32)
+        out[start : start + chunk_size] = x @ C.T
+    return out
+
+
+def _update_centers(X, y_pred, distances, n_clusters, chunk_size=1024):
+    # Sums of the clusters, accumulated in float32 one chunk at a time
+    centers = np.zeros((n_clusters, X.shape[1]), dtype=np.float32)
+    for start in range(0, len(X), chunk_size):
+        x = np.asarray(X[start : start + chunk_size], dtype=np.float32)
+        one_hot = sparse.csr_matrix(
+            (
+                np.ones(len(x), dtype=np.float32),
+                (y_pred[start : start + chunk_size], np.arange(len(x))),
+            ),
+            shape=(n_clusters, len(x)),
+        )
+        centers += one_hot @ x
+    counts = np.bincount(y_pred, minlength=n_clusters)
+
+    # Move the centres of empty clusters to the farthest samples
+    empty = np.flatnonzero(counts == 0)
+    if len(empty) != 0:
+        farthest = np.argsort(distances)[::-1][: len(empty)]
+        centers[empty] = X[np.sort(farthest)]
+        counts[empty] = 1
+    centers /= counts[:, None]
+    return centers
+
+
+def _init_kmeans_plusplus(X, n_clusters, x_norms, rng, weights=None):
+    # Greedy k-means++: among a few sampled candidates, keep the one which
+    # reduces the potential the most
+    if weights is None:
+        weights = np.ones(len(X))
+    n_trials = 2 + int(np.log(n_clusters))
+    centers = np.empty((n_clusters, X.shape[1]), dtype=np.float32)
+    first = rng.choice(len(X), p=weights / weights.sum())
+    centers[0] = X[first]
+    closest = np.maximum(
+        x_norms - 2 * _dot(X, centers[:1])[:, 0] + x_norms[first], 0
+    )
+    for i in range(1, n_clusters):
+        p = weights * closest
+        if p.sum() == 0:
+            p = weights
+        trials = rng.choice(len(X), n_trials, p=p / p.sum())
+        candidates = np.asarray(X[trials], dtype=np.float32)
+        distances = (
+            x_norms[:, None] - 2 * _dot(X, candidates) + x_norms[trials]
+        )
+        distances = np.minimum(closest[:, None], np.maximum(distances, 0))
+        best = (weights @ distances).argmin()
+        centers[i] = candidates[best]
+        closest = distances[:, best]
+    return centers
+
+
+def _init_kmeans_parallel(
+    X, n_clusters, x_norms, rng, chunk_size, executor, n_rounds=5
+):
+    # Oversample about 2 * n_clusters candidates per round, each with a
+    # probability proportional to its squared distance to the candidates
+    oversampling = 2 * n_clusters
+    candidates = [rng.randint(len(X))]
+    closest = np.maximum(
+        x_norms
+        - 2 * _dot(X, X[candidates[:1]], chunk_size)[:, 0]
+        + x_norms[candidates[0]],
+        0,
+    )
+    for _ in range(n_rounds):
+        cost = closest.sum(dtype=np.float64)
+        if cost == 0:
+            break
+        p = np.minimum(oversampling * closest / cost, 1)
+        new = np.flatnonzero(rng.uniform(size=len(X)) < p)
+        if len(new) == 0:
+            continue
+        candidates.extend(new)
+        _, distances = assign(X, X[new], x_norms, chunk_size, executor)
+        np.minimum(closest, distances, out=closest)
+
+    candidates = np.unique(candidates)
+    if len(candidates) <= n_clusters:
+        rest = np.setdiff1d(np.arange(len(X)), candidates)
+        extra = rng.choice(rest, n_clusters - len(candidates), replace=False)
+        return np.array(
+            X[np.sort(np.concatenate([candidates, extra]))], dtype=np.float32
+        )
+
+    # Weight each candidate by the samples nearest to it, then reduce the
+    # candidates to `n_clusters` centres by weighted k-means++
+    C = np.array(X[candidates], dtype=np.float32)
+    nearest, _ = assign(X, C, x_norms, chunk_size, executor)
+    weights = np.bincount(nearest, minlength=len(C)).astype(np.float64)
+    return _init_kmeans_plusplus(
+        C, n_clusters, x_norms[candidates], rng, weights
+    )
+
+
+class MiniBatchKMeans:
+    """Streaming mini-batch k-means
+
+    Centres are updated incrementally from batches of samples, so the
+    samples never have to be held in memory at once. The first batches are
+    buffered until `init_size` samples are available to seed the centres
+    with k-means++. Each centre is the running mean of every sample
+    assigned to it so far.
+
+    As in scikit-learn, centres which received fewer than
+    `reassignment_ratio` times the samples of the largest cluster are moved
+    to samples of the current batch, drawn with probability proportional to
+    their squared distance to the nearest centre. A moved centre splits the
+    cluster of its sample and takes half of its count, so regions missed by
+    the seeding, which have been merged into another cluster, still end up
+    with a centre of their own.
+
+    Parameters
+    ----------
+    n_clusters: int
+        Number of clusters
+    init_size: int or None
+        Number of samples used for seeding. Defaults to
+        max(3 * n_clusters, 3072)
+    reassignment_ratio: float
+        Relative size under which a cluster is reassigned. 0 disables
+        reassignment
+    seed: int or None
+        Random seed
+    chunk_size: int
+        Number of samples whose distances are computed at a time
+    """
+
+    def __init__(
+        self,
+        n_clusters,
+        init_size=None,
+        reassignment_ratio=0.01,
+        seed=None,
+        chunk_size=1024,
+    ):
+        self.n_clusters = n_clusters
+        self.init_size = init_size or max(3 * n_clusters, 3072)
+        self.reassignment_ratio = reassignment_ratio
+        self.rng = np.random.RandomState(seed)
+        self.chunk_size = chunk_size
+        self.centers = None
+        self.counts = np.zeros(n_clusters, dtype=np.int64)
+        self._buffer = []
+        self._n_buffered = 0
+
+    def partial_fit(self, X):
+        """Update the centres with a batch of samples of shape
+        (batch_size, n_features)"""
+        X = np.asarray(X, dtype=np.float32)
+        if self.centers is None:
+            self._buffer.append(X)
+            self._n_buffered += len(X)
+            if self._n_buffered >= self.init_size:
+                self._init_centers()
+            return self
+
+        y_pred, distances = assign(X, self.centers, chunk_size=self.chunk_size)
+        one_hot = sparse.csr_matrix(
+            (np.ones(len(X), dtype=np.float32), (y_pred, np.arange(len(X)))),
+            shape=(self.n_clusters, len(X)),
+        )
+        sums = np.asarray(one_hot @ X)
+        batch_counts = np.bincount(y_pred, minlength=self.n_clusters)
+        self.counts += batch_counts
+        updated = batch_counts != 0
+        self.centers[updated] += (
+            sums[updated] - batch_counts[updated, None] * self.centers[updated]
+        ) / self.counts[updated, None]
+        self._reassign(X, y_pred, distances)
+        return self
+
+    def fit(self, X, n_passes=1, batch_size=4096):
+        """Fit on `X`, e.g. a memory-mapped array, one batch at a time"""
+        for _ in range(n_passes):
+            for start in range(0, len(X), batch_size):
+                self.partial_fit(X[start : start + batch_size])
+        return self
+
+    def predict(self, X):
+        """Cluster of every sample of `X`, computed in chunks"""
+        if self.centers is None:
+            self._init_centers()
+        y_pred, _ = assign(X, self.centers, chunk_size=self.chunk_size)
+        return y_pred
+
+    def _reassign(self, X, y_pred, distances):
+        starved = np.flatnonzero(
+            self.counts < self.reassignment_ratio * self.counts.max()
+        )
+        # Never move more than half of the batch, smallest clusters first
+        starved = starved[np.argsort(self.counts[starved], kind="stable")]
+        starved = starved[: len(X) // 2]
+        weights = distances.astype(np.float64)
+        if len(starved) == 0 or np.count_nonzero(weights) < len(starved):
+            return
+        picked = self.rng.choice(
+            len(X), len(starved), replace=False, p=weights / weights.sum()
+        )
+        for center, sample in zip(starved, picked):
+            # The moved centre splits the cluster of the picked sample, and
+            # takes half of its count so that both halves keep moving
+            donor = y_pred[sample]
+            self.centers[center] = X[sample]
+            half = self.counts[donor] // 2 if donor != center else 0
+            self.counts[donor] -= half
+            self.counts[center] = max(half, 1)
+
+    def _init_centers(self):
+        X = np.concatenate(self._buffer)
+        if len(X) < self.n_clusters:
+            raise ValueError(
+                f"{len(X)} samples are not enough for {self.n_clusters} "
+                "clusters"
+            )
+        self._buffer = []
+        self.centers = _init_kmeans_plusplus(
+            X, self.n_clusters, row_norms(X, self.chunk_size), self.rng
+        )
+        self.partial_fit(X)
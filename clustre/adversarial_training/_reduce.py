@@ -0,0 +1,93 @@
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.random_projection import SparseRandomProjection
+
+
+def make_reducer(reduction, n_components, seed=0):
+    """Create an unfitted dimensionality reducer
+
+    Parameters
+    ----------
+    reduction: str
+        "pca" for randomized PCA, or "random_projection" for a sparse random
+        projection
+    n_components: int
+        Target dimension
+    seed: int
+        Random seed
+
+    Returns
+    -------
+    sklearn.base.TransformerMixin
+        The reducer
+    """
+    if reduction == "pca":
+        return PCA(n_components, svd_solver="randomized", random_state=seed)
+    elif reduction == "random_projection":
+        return SparseRandomProjection(n_components, random_state=seed)
+    else:
+        raise NotImplementedError
+
+
+def reduce_features(
+    X,
+    reduction="pca",
+    n_components=64,
+    n_fit=10000,
+    chunk_size=4096,
+    seed=0,
+    out=None,
+):
+    """Reduce the dimension of the clustering features
+
+    The reducer is fit on a random subsample of `n_fit` samples, then
+    applied to `X` one chunk at a time. Rows keep their order, so indices
+    into the reduced features are indices into the dataset.
+
+    Parameters
+    ----------
+    X: numpy.ndarray
+        Features of shape (n_samples, n_features), possibly memory-mapped
+    reduction: str
+        "pca" or "random_projection"
+    n_components: int
+        Target dimension
+    n_fit: int
+        Number of samples the reducer is fit on
+    chunk_size: int
+        Number of samples transformed at a time
+    seed: int
+        Random seed
+    out: str or None
+        If given, path of a `.npy` file into which the reduced features are
+        memory-mapped
+
+    Returns
+    -------
+    (numpy.ndarray, sklearn.base.TransformerMixin)
+        Reduced features of shape (n_samples, n_components), and the
+        fitted reducer
+    """
+    rng = np.random.RandomState(seed)
+    reducer = make_reducer(reduction, n_components, seed)
+    if len(X) > n_fit:
+        idx = np.sort(rng.choice(len(X), n_fit, replace=False))
+        reducer.fit(np.asarray(X[idx], dtype=np.float32))
+    else:
+        reducer.fit(np.asarray(X, dtype=np.float32))
+
+    shape = (len(X), n_components)
+    if out is None:
+        reduced = np.empty(shape, dtype=np.float32)
+    else:
+        reduced = np.lib.format.open_memmap(
+            out, mode="w+", dtype=np.float32, shape=shape
+        )
+    for start in range(0, len(X), chunk_size):
+        end = start + chunk_size
+        reduced[start:end] = reducer.transform(
+            np.asarray(X[start:end], dtype=np.float32)
+        )
+    if out is not None:
+        reduced.flush()
+    return reduced, reducer
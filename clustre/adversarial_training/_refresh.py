@@ -0,0 +1,221 @@
+import math
+from collections import OrderedDict
+
+import torch
+from torch import nn
+
+from clustre.attacking import pgd_perturbs
+from clustre.attacking._utils import unreduced_criterion
+
+
+class CentroidRefresher:
+    """Incremental refresh of the PGD perturbations of cluster centroids
+
+    The first call to `refresh` attacks every centroid. On later calls, the
+    loss of every centroid under its current perturbation is measured with
+    one gradient-free forward pass, and only the centroids whose loss
+    drifted most since they were last attacked, or whose perturbation is
+    older than `max_age` epochs, are attacked again, warm-started from
+    their previous perturbation.
+
+    Parameters
+    ----------
+    centroids_X: torch.Tensor
+        Images of the cluster centroids
+    centroids_y: torch.Tensor
+        Labels of the cluster centroids
+    criterion: function
+        Criterion function
+    epsilon: float
+        Perturbation bound
+    pgd_parameters: dict
+        Parameters to be passed to `pgd_perturbs`
+    refresh_fraction: float
+        Fraction of the clusters re-attacked each epoch, on top of the
+        clusters whose perturbation is too old
+    max_age: int
+        Epochs after which a perturbation is always refreshed
+    batch_size: int
+        Batch size of the loss measurement
+    """
+
+    def __init__(
+        self,
+        centroids_X,
+        centroids_y,
+        criterion=nn.CrossEntropyLoss(),
+        epsilon=0.3,
+        pgd_parameters={},
+        refresh_fraction=0.2,
+        max_age=5,
+        batch_size=1024,
+    ):
+        self.centroids_X = centroids_X
+        self.centroids_y = centroids_y
+        self.criterion = criterion
+        self.epsilon = epsilon
+        self.pgd_parameters = pgd_parameters
+        self.refresh_fraction = refresh_fraction
+        self.max_age = max_age
+        self.batch_size = batch_size
+
+        n_clusters = len(centroids_X)
+        self.perturbs = None
+        self.losses = torch.zeros(n_clusters, device=centroids_X.device)
+        self.age = torch.zeros(
+            n_clusters, dtype=torch.long, device=centroids_X.device
+        )
+
+    def refresh(self, model):
+        """Return the perturbations of every centroid after re-attacking
+        the stale ones
+
+        Returns
+        -------
+        torch.Tensor
+            Perturbations of every centroid
+        """
+        n_clusters = len(self.centroids_X)
+        warm_start = self.perturbs is not None
+        self.age += 1
+        if not warm_start:
+            self.perturbs = torch.zeros_like(self.centroids_X)
+            stale = torch.arange(n_clusters, device=self.centroids_X.device)
+        else:
+            drift = (self.current_losses(model) - self.losses).abs()
+            aged = self.age >= self.max_age
+            drift[aged] = math.inf
+            n_stale = math.ceil(self.refresh_fraction * n_clusters) + int(
+                aged.sum().item()
+            )
+            stale = drift.topk(min(n_stale, n_clusters)).indices
+
+        if len(stale) != 0:
+            result = pgd_perturbs(
+                model,
+                self.criterion,
+                self.centroids_X[stale],
+                self.centroids_y[stale],
+                epsilon=self.epsilon,
+                return_result=True,
+                init=self.perturbs[stale] if warm_start else None,
+                **self.pgd_parameters,
+            )
+            self.perturbs[stale] = result.perturbs
+            self.losses[stale] = result.loss
+            self.age[stale] = 0
+        return self.perturbs
+
+    def current_losses(self, model):
+        """Loss of every centroid under its current perturbation"""
+        model.eval()
+        criterion = unreduced_criterion(self.criterion)
+        losses = []
+        with torch.no_grad():
+            for start in range(0, len(self.centroids_X), self.batch_size):
+                end = start + self.batch_size
+                images = torch.clamp(
+                    self.centroids_X[start:end] + self.perturbs[start:end],
+                    min=-1,
+                    max=1,
+                )
+                losses.append(
+                    criterion(model(images), self.centroids_y[start:end])
+                )
+        return torch.cat(losses)
+
+
+class LazyCentroidPerturbs:
+    """PGD perturbations of cluster centroids, computed on first use
+
+    The centroids of a batch which have no perturbation yet are attacked
+    together, and their perturbations are kept in a bounded cache from
+    which the least recently used ones are dropped. Paired with
+    `ClusterBatchSampler`, each centroid is attacked once per epoch, right
+    before its samples are trained on.
+
+    Parameters
+    ----------
+    centroids_X: torch.Tensor
+        Images of the cluster centroids
+    centroids_y: torch.Tensor
+        Labels of the cluster centroids
+    criterion: function
+        Criterion function
+    epsilon: float
+        Perturbation bound
+    pgd_parameters: dict
+        Parameters to be passed to `pgd_perturbs`
+    max_size: int
+        Maximum number of perturbations kept, unless a single batch spans
+        more clusters
+    """
+
+    def __init__(
+        self,
+        centroids_X,
+        centroids_y,
+        criterion=nn.CrossEntropyLoss(),
+        epsilon=0.3,
+        pgd_parameters={},
+        max_size=64,
+    ):
+        self.centroids_X = centroids_X
+        self.centroids_y = centroids_y
+        self.criterion = criterion
+        self.epsilon = epsilon
+        self.pgd_parameters = pgd_parameters
+        self.max_size = max_size
+        self.cache = OrderedDict()
+
+    def perturbs(self, model, cluster_idx):
+        """Perturbations of the centroids of `cluster_idx`
+
+        Parameters
+        ----------
+        model: torch.nn.model
+            The model to be attacked
+        cluster_idx: torch.Tensor
+            Cluster of each sample of a batch
+
+        Returns
+        -------
+        torch.Tensor
+            Perturbation of the centroid of each sample
+        """
+        ids, inverse = torch.unique(cluster_idx, return_inverse=True)
+        # Order the clusters by first appearance in the batch, so that the
+        # cluster continuing into the next batch is the most recently used
+        first = torch.full(
+            (len(ids),), len(cluster_idx), device=cluster_idx.device
+        ).scatter_reduce(
+            0,
+            inverse,
+            torch.arange(len(cluster_idx), device=cluster_idx.device),
+            reduce="amin",
+        )
+        ids = ids.tolist()
+        missing = [i for i in ids if i not in self.cache]
+        if missing:
+            idx = torch.tensor(missing, device=self.centroids_X.device)
+            perturbs = pgd_perturbs(
+                model,
+                self.criterion,
+                self.centroids_X[idx],
+                self.centroids_y[idx],
+                epsilon=self.epsilon,
+                **self.pgd_parameters,
+            )
+            self.cache.update(zip(missing, perturbs))
+
+        batch = torch.stack([self.cache[i] for i in ids])
+        for i in first.argsort().tolist():
+            self.cache.move_to_end(ids[i])
+        # The clusters of this batch are never evicted, even if there are
+        # more of them than `max_size`
+        while len(self.cache) > max(self.max_size, len(ids)):
+            self.cache.popitem(last=False)
+        return batch[inverse.to(batch.device)]
+
+    def clear(self):
+        self.cache.clear()
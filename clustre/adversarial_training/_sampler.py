@@ -0,0 +1,47 @@
+import math
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class ClusterBatchSampler(Sampler):
+    """Batches of samples grouped by cluster
+
+    Each epoch, the clusters are visited in a random order and the samples
+    of each cluster are laid out contiguously in a random order. Every
+    batch therefore spans only a few consecutive clusters, and every
+    cluster appears in consecutive batches only.
+
+    Parameters
+    ----------
+    cluster_ids: numpy.ndarray or torch.Tensor
+        Cluster of each sample
+    batch_size: int
+        Batch size
+    seed: int or None
+        Random seed
+    """
+
+    def __init__(self, cluster_ids, batch_size=128, seed=None):
+        if isinstance(cluster_ids, torch.Tensor):
+            cluster_ids = cluster_ids.cpu().numpy()
+        self.cluster_ids = np.asarray(cluster_ids)
+        self.batch_size = batch_size
+        self.rng = np.random.RandomState(seed)
+
+    def __iter__(self):
+        n_clusters = self.cluster_ids.max() + 1
+        rank = np.empty(n_clusters, dtype=int)
+        rank[self.rng.permutation(n_clusters)] = np.arange(n_clusters)
+        order = np.lexsort(
+            (
+                self.rng.random_sample(len(self.cluster_ids)),
+                rank[self.cluster_ids],
+            )
+        )
+        for start in range(0, len(order), self.batch_size):
+            yield order[start : start + self.batch_size].tolist()
+
+    def __len__(self):
+        return math.ceil(len(self.cluster_ids) / self.batch_size)
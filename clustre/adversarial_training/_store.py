@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+from torch import nn
+
+from clustre.adversarial_training._cluster import KMeansWrapper
+from clustre.helpers import (
+    DiskLRU,
+    hash_dataset,
+    hash_params,
+    hash_state_dict,
+)
+
+
+class ClusterStore(DiskLRU):
+    """Content-addressed on-disk store of clusterings
+
+    Clusterings are keyed by a hash of the model's state dict, the dataset
+    and the clustering parameters. Each entry is a directory holding the
+    cluster of every sample, the medoid indices and the centres as `.npy`
+    files, which are loaded memory-mapped, along with the fitted feature
+    reducer if any. Once the store grows over `max_size` bytes, the least
+    recently used entries are evicted.
+
+    Parameters
+    ----------
+    root: str
+        Directory of the store
+    max_size: int
+        Maximum size of the store, in bytes
+    """
+
+    suffix = ".clusters"
+
+    def __init__(self, root, max_size=2 ** 30):
+        super().__init__(root, max_size)
+
+    def key(
+        self,
+        model,
+        dataset,
+        cluster_with,
+        n_clusters,
+        epsilon=0.3,
+        criterion=nn.CrossEntropyLoss(),
+        **params,
+    ):
+        """Hash of the inputs of a clustering
+
+        Parameters
+        ----------
+        model: torch.nn.model
+            The model the features are computed with
+        dataset: torch.utils.data.Dataset
+            Clustered dataset
+        cluster_with: str
+            Features of the clustering
+        n_clusters: int
+            Number of clusters
+        epsilon: float
+            Perturbation bound of the features
+        criterion: function
+            Criterion function
+        **params:
+            Other parameters of the clustering, e.g. the method
+
+        Returns
+        -------
+        str
+            The key
+        """
+        h = hashlib.sha1()
+        # Raw data features do not depend on the model
+        if cluster_with != "original_data":
+            h.update(hash_state_dict(model).encode())
+            h.update(repr(criterion).encode())
+            h.update(str(epsilon).encode())
+        h.update(hash_dataset(dataset).encode())
+        h.update(
+            hash_params(
+                dict(
+                    cluster_with=cluster_with, n_clusters=n_clusters, **params
+                )
+            ).encode()
+        )
+        return h.hexdigest()
+
+    def load(self, key):
+        """Load a stored clustering
+
+        Returns
+        -------
+        (KMeansWrapper, object) or None
+            The clustering and its fitted feature reducer, or None if `key`
+            is not stored
+        """
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        self.touch(path)
+
+        km = KMeansWrapper.__new__(KMeansWrapper)
+        km.y_pred = np.load(os.path.join(path, "y_pred.npy"), mmap_mode="r")
+        km.centroids_idxs = np.load(os.path.join(path, "centroids_idxs.npy"))
+        km.centers = np.load(os.path.join(path, "centers.npy"), mmap_mode="r")
+        with open(os.path.join(path, "meta.json")) as f:
+            km.inertia = json.load(f)["inertia"]
+
+        reducer = None
+        reducer_path = os.path.join(path, "reducer.pkl")
+        if os.path.exists(reducer_path):
+            with open(reducer_path, "rb") as f:
+                reducer = pickle.load(f)
+        return km, reducer
+
+    def save(self, key, km, reducer=None):
+        """Store a clustering and its fitted feature reducer"""
+        path = self.path(key)
+        partial_path = path + ".partial"
+        shutil.rmtree(partial_path, ignore_errors=True)
+        os.makedirs(partial_path)
+
+        n_clusters = len(km.centers)
+        dtype = np.int16 if n_clusters <= np.iinfo(np.int16).max else np.int32
+        np.save(
+            os.path.join(partial_path, "y_pred.npy"),
+            np.asarray(km.y_pred).astype(dtype),
+        )
+        np.save(
+            os.path.join(partial_path, "centroids_idxs.npy"),
+            np.asarray(km.centroids_idxs).astype(np.int64),
+        )
+        np.save(
+            os.path.join(partial_path, "centers.npy"),
+            np.asarray(km.centers, dtype=np.float32),
+        )
+        with open(os.path.join(partial_path, "meta.json"), "w") as f:
+            json.dump({"inertia": float(km.inertia)}, f)
+        if reducer is not None:
+            with open(os.path.join(partial_path, "reducer.pkl"), "wb") as f:
+                pickle.dump(reducer, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(partial_path, path)
+        self.evict(keep=path)
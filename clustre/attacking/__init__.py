@@ -1,3 +1,8 @@
 from clustre.attacking._fgsm import fgsm, fgsm_perturbs
 from clustre.attacking._maxloss import maxloss, maxloss_perturbs
 from clustre.attacking._pgd import pgd, pgd_perturbs
+from clustre.attacking._result import AttackResult
+from clustre.attacking._session import attack_session
+from clustre.attacking._stream import attack_stream, get_attack
+from clustre.attacking._cache import PerturbCache
+from clustre.attacking._parallel import parallel_attack
@@ -0,0 +1,125 @@
+import hashlib
+import os
+
+from torch import nn
+from torch.utils.data import DataLoader, Subset
+
+from clustre.attacking._stream import attack_stream, get_attack
+from clustre.helpers import (
+    DiskLRU,
+    hash_dataset,
+    hash_params,
+    hash_state_dict,
+    load_perturbs,
+)
+
+
+class PerturbCache(DiskLRU):
+    """Content-addressed on-disk cache of dataset perturbations
+
+    Perturbations are keyed by a hash of the model's state dict, the attack
+    and its parameters, and the dataset with the sample indices. They are
+    stored in the packed perturbation format. Once the cache grows over
+    `max_size` bytes, the least recently used files are evicted.
+
+    Parameters
+    ----------
+    root: str
+        Directory of the cache
+    max_size: int
+        Maximum size of the cache, in bytes
+    """
+
+    suffix = ".perturbs"
+
+    def __init__(self, root, max_size=2 ** 32):
+        super().__init__(root, max_size)
+
+    def key(
+        self,
+        model,
+        dataset,
+        attack,
+        criterion=nn.CrossEntropyLoss(),
+        indices=None,
+        **params,
+    ):
+        attack = get_attack(attack)
+        h = hashlib.sha1()
+        h.update(hash_state_dict(model).encode())
+        h.update(f"{attack.__module__}.{attack.__qualname__}".encode())
+        h.update(repr(criterion).encode())
+        h.update(hash_params(params).encode())
+        h.update(hash_dataset(dataset, indices).encode())
+        return h.hexdigest()
+
+    def perturbs(
+        self,
+        model,
+        dataset,
+        attack,
+        criterion=nn.CrossEntropyLoss(),
+        indices=None,
+        batch_size=128,
+        device=None,
+        **params,
+    ):
+        """Perturbations of `dataset`, generated on a cache miss
+
+        Parameters
+        ----------
+        model: torch.nn.model
+            The model to be attacked
+        dataset: torch.utils.data.Dataset
+            Dataset to be attacked
+        attack: str or function
+            "fgsm", "pgd", "maxloss" or a perturbation function
+        criterion: function
+            Criterion function
+        indices: sequence of int or None
+            If given, only these samples of `dataset` are attacked
+        batch_size: int
+            Batch size used to generate the perturbations
+        device: torch.device, str, or None
+            Device to be used
+        **params:
+            Parameters to be passed to the attack
+
+        Returns
+        -------
+        clustre.helpers.PerturbReader
+            Lazy reader of the perturbations, in the order of the samples
+        """
+        key = self.key(
+            model,
+            dataset,
+            attack,
+            criterion=criterion,
+            indices=indices,
+            **params,
+        )
+        path = self.path(key)
+
+        if os.path.exists(path):
+            self.touch(path)
+            return load_perturbs(path)
+
+        if indices is not None:
+            dataset = Subset(dataset, indices)
+        loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+        partial_path = path + ".partial"
+        for _ in attack_stream(
+            model,
+            loader,
+            attack,
+            criterion=criterion,
+            out=partial_path,
+            out_format="packed",
+            device=device,
+            **params,
+        ):
+            pass
+        os.replace(partial_path, path)
+
+        self.evict(keep=path)
+        return load_perturbs(path)
@@ -1,5 +1,8 @@
 import torch
 
+from clustre.attacking._result import AttackResult
+from clustre.attacking._session import attack_session
+
 
 def fgsm(
     model,
@@ -10,6 +13,7 @@ def fgsm(
     random=False,
     alpha=0.375,
     device=None,
+    return_result=False,
 ):
     if device is not None:
         model.to(device)
@@ -25,7 +29,10 @@ def fgsm(
         random=random,
         alpha=alpha,
         device=device,
+        return_result=return_result,
     )
+    if return_result:
+        return perturb
     attack_image = torch.clamp(image + perturb, min=-1, max=1)
 
     return attack_image
@@ -40,6 +47,7 @@ def fgsm_perturbs(
     random=False,
     alpha=0.375,
     device=None,
+    return_result=False,
 ):
     if len(image.shape) == 3:
         image.unsqueeze_(0)
@@ -57,19 +65,32 @@ def fgsm_perturbs(
         perturb.uniform_(-epsilon, epsilon)
     perturb = perturb.to(image.device)
 
-    image.requires_grad = True
-    perturb.requires_grad = True
+    with attack_session(model):
+        perturb.requires_grad = True
 
-    output = model(image + perturb)
-    loss = criterion(output, label)
-    loss.backward()
+        output = model(image + perturb)
+        loss = criterion(output, label)
+        loss.backward()
 
     grad = perturb.grad.detach()
     if random:
-        perturb.data = torch.clamp(
-            perturb + alpha * torch.sign(grad), -epsilon, epsilon
+        perturb = torch.clamp(
+            perturb.detach() + alpha * torch.sign(grad), -epsilon, epsilon
         )
     else:
-        perturb.data = torch.clamp(torch.sign(grad), -epsilon, epsilon)
+        perturb = torch.clamp(torch.sign(grad), -epsilon, epsilon)
 
+    if return_result:
+        return AttackResult.evaluate(
+            model,
+            criterion,
+            image,
+            label,
+            perturb,
+            n_iterations=torch.ones(
+                len(image), dtype=torch.long, device=image.device
+            ),
+            n_forward=1,
+            n_backward=1,
+        )
     return perturb
@@ -1,6 +1,10 @@
 import torch
 from torch import optim
 
+from clustre.attacking._pgd import pgd_project_
+from clustre.attacking._result import AttackResult
+from clustre.attacking._session import attack_session
+
 
 def maxloss(
     model,
@@ -13,6 +17,7 @@ def maxloss(
     n_epoches=100,
     verbose=True,
     device=None,
+    return_result=False,
 ):
     model.eval()
 
@@ -33,7 +38,10 @@ def maxloss(
         n_epoches,
         verbose,
         device,
+        return_result,
     )
+    if return_result:
+        return perturbs
     return torch.clamp(original_images + perturbs, min=-1, max=1)
 
 
@@ -48,6 +56,7 @@ def maxloss_perturbs(
     n_epoches=100,
     verbose=True,
     device=None,
+    return_result=False,
 ):
     model.eval()
 
@@ -57,25 +66,46 @@ def maxloss_perturbs(
         labels = labels.to(device)
 
     original_images = images
+    # Projection bounds are computed once
+    lower = images - epsilon
+    upper = images + epsilon
+    images = images.detach().clone()
+    images.requires_grad = True
 
     perturbs = torch.rand(images.shape, device=images.device) / 1000
     optimizer = optim([perturbs], **optim_params)
 
-    for e in range(n_epoches + 1):
-        images = images.detach()
-        images.requires_grad = True
+    with attack_session(model):
+        for e in range(n_epoches + 1):
+            optimizer.zero_grad()
+            output = model(images)
+            loss = -1 * criterion(output, labels)
+            loss.backward()
+            optimizer.step()
 
-        optimizer.zero_grad()
-        output = model(images)
-        loss = -1 * criterion(output, labels)
-        loss.backward()
-        optimizer.step()
+            if e == n_epoches:
+                perturbs = torch.clamp(perturbs, -epsilon, epsilon)
+                break
 
-        if e == n_epoches:
-            return torch.clamp(perturbs, -epsilon, epsilon)
+            with torch.no_grad():
+                images.grad = None
+                images.add_(perturbs)
+                pgd_project_(images, lower, upper)
 
-        images = images + perturbs
-        images = torch.max(
-            torch.min(images, original_images + epsilon),
-            original_images - epsilon,
+    if return_result:
+        return AttackResult.evaluate(
+            model,
+            criterion,
+            original_images,
+            labels,
+            perturbs,
+            n_iterations=torch.full(
+                (len(labels),),
+                n_epoches + 1,
+                dtype=torch.long,
+                device=labels.device,
+            ),
+            n_forward=n_epoches + 1,
+            n_backward=n_epoches + 1,
         )
+    return perturbs
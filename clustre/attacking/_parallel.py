@@ -0,0 +1,174 @@
+import copy
+import math
+import multiprocessing
+import os
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, Subset
+
+from clustre.attacking._stream import get_attack
+
+# State of a worker process, set by `_init_worker`
+_worker = {}
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def parallel_attack(
+    model,
+    dataset,
+    attack,
+    out,
+    criterion=nn.CrossEntropyLoss(),
+    n_workers=None,
+    threads_per_worker=None,
+    batch_size=128,
+    shard_size=None,
+    mp_context=None,
+    **params,
+):
+    """Generate perturbations of a dataset with a pool of CPU processes
+
+    The dataset is split into contiguous shards, which are attacked by
+    worker processes each holding its own copy of the model. Every worker is
+    pinned to its own subset of cores and runs `threads_per_worker` intra-op
+    threads. Perturbations are written into a shared memory-mapped `.npy`
+    file in dataset order.
+
+    Parameters
+    ----------
+    model: torch.nn.model
+        The model to be attacked
+    dataset: torch.utils.data.Dataset
+        Dataset to be attacked
+    attack: str or function
+        "fgsm", "pgd", "maxloss" or a module-level perturbation function
+    out: str
+        Path of the `.npy` file to be written
+    criterion: function
+        Criterion function
+    n_workers: int or None
+        Number of worker processes. Defaults to one per
+        `threads_per_worker` available cores
+    threads_per_worker: int or None
+        Intra-op threads of each worker. Defaults to an even split of the
+        available cores
+    batch_size: int
+        Batch size of each attack
+    shard_size: int or None
+        Number of samples per task. Defaults to four shards per worker
+    mp_context: str or None
+        Start method of the processes, e.g. "fork" or "spawn"
+    **params:
+        Parameters to be passed to the attack
+
+    Returns
+    -------
+    numpy.memmap
+        Read-only view of the perturbations
+    """
+    cores = available_cores()
+    if n_workers is None:
+        n_workers = max(1, len(cores) // (threads_per_worker or 1))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, len(cores) // n_workers)
+    if shard_size is None:
+        shard_size = math.ceil(len(dataset) / (4 * n_workers))
+        shard_size = batch_size * math.ceil(shard_size / batch_size)
+
+    sample_shape = tuple(dataset[0][0].shape)
+    storage = np.lib.format.open_memmap(
+        out,
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(dataset),) + sample_shape,
+    )
+    del storage
+
+    context = multiprocessing.get_context(mp_context)
+    core_sets = context.Queue()
+    for i in range(n_workers):
+        start = (i * threads_per_worker) % len(cores)
+        core_sets.put(cores[start : start + threads_per_worker])
+
+    model = copy.deepcopy(model).cpu()
+    shards = [
+        (start, min(start + shard_size, len(dataset)))
+        for start in range(0, len(dataset), shard_size)
+    ]
+    with context.Pool(
+        n_workers,
+        initializer=_init_worker,
+        initargs=(
+            model,
+            dataset,
+            get_attack(attack),
+            criterion,
+            params,
+            out,
+            batch_size,
+            threads_per_worker,
+            core_sets,
+        ),
+    ) as pool:
+        for _ in pool.imap_unordered(_attack_shard, shards):
+            pass
+
+    return np.load(out, mmap_mode="r")
+
+
+def _init_worker(
+    model,
+    dataset,
+    attack,
+    criterion,
+    params,
+    out,
+    batch_size,
+    threads,
+    core_sets,
+):
+    cores = core_sets.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+
+    _worker.update(
+        model=model,
+        dataset=dataset,
+        attack=attack,
+        criterion=criterion,
+        params=params,
+        storage=np.load(out, mmap_mode="r+"),
+        batch_size=batch_size,
+    )
+
+
+def _attack_shard(shard):
+    start, end = shard
+    loader = DataLoader(
+        Subset(_worker["dataset"], range(start, end)),
+        batch_size=_worker["batch_size"],
+        shuffle=False,
+    )
+    offset = start
+    for batch in loader:
+        images, labels = batch[0], batch[1]
+        perturbs = _worker["attack"](
+            _worker["model"],
+            _worker["criterion"],
+            images,
+            labels,
+            **_worker["params"],
+        )
+        n = len(perturbs)
+        _worker["storage"][offset : offset + n] = perturbs.detach().numpy()
+        offset += n
+    _worker["storage"].flush()
+    return end - start
@@ -1,5 +1,11 @@
+import math
+
 import torch
 
+from clustre.attacking._result import AttackResult
+from clustre.attacking._session import attack_session
+from clustre.attacking._utils import unreduced_criterion
+
 
 def pgd(
     model,
@@ -11,6 +17,12 @@ def pgd(
     n_epoches=100,
     verbose=True,
     device=None,
+    early_stop=False,
+    n_restarts=1,
+    max_batch_size=None,
+    adaptive=False,
+    return_result=False,
+    init=None,
 ):
     model.eval()
 
@@ -20,7 +32,7 @@ def pgd(
         labels = labels.to(device)
 
     original_images = images
-    perturbs = pgd_perturbs(
+    result = pgd_perturbs(
         model,
         criterion,
         images,
@@ -30,8 +42,16 @@ def pgd(
         n_epoches,
         verbose,
         device,
+        early_stop=early_stop,
+        n_restarts=n_restarts,
+        max_batch_size=max_batch_size,
+        adaptive=adaptive,
+        return_result=return_result,
+        init=init,
     )
-    return torch.clamp(original_images + perturbs, min=-1, max=1)
+    if return_result:
+        return result
+    return torch.clamp(original_images + result, min=-1, max=1)
 
 
 def pgd_perturbs(
@@ -44,7 +64,57 @@ def pgd_perturbs(
     n_epoches=100,
     verbose=True,
     device=None,
+    early_stop=False,
+    n_restarts=1,
+    max_batch_size=None,
+    adaptive=False,
+    return_result=False,
+    init=None,
 ):
+    """Projected Gradient Descent perturbations
+
+    Parameters
+    ----------
+    model: torch.nn.model
+        The model to be attacked
+    criterion: function
+        Criterion function
+    images: torch.Tensor
+        A batch of images to be attacked
+    labels: torch.Tensor
+        Labels of the images
+    epsilon: float
+        Perturbation bound
+    step_size: float
+        PGD step size
+    n_epoches: int
+        PGD iterations
+    device: torch.device, str, or None
+        Device to be used
+    early_stop: bool
+        If True, samples which are already misclassified are frozen with
+        their current perturbation and removed from the working batch, so
+        later iterations only run on the samples still being attacked
+    n_restarts: int
+        Number of uniformly random starts inside the epsilon-ball. All
+        restarts are attacked together as one wide batch, and for each
+        sample the perturbation whose attacked image has the highest loss
+        is kept
+    max_batch_size: int or None
+        Upper bound on the size of the wide batch. Restarts are split into
+        chunks of at most this many samples
+    adaptive: bool
+        If True, run Auto-PGD instead: the step size starts at 2 * epsilon
+        and is halved per sample whenever its loss stalls, steps use
+        momentum, and the best perturbation found so far is returned.
+        `step_size` is ignored, and `n_epoches` is still the number of
+        gradient evaluations
+    return_result: bool
+        If True, return an `AttackResult` instead of the perturbations
+    init: torch.Tensor or None
+        Initial perturbations to warm-start the attack from. Cannot be used
+        with random restarts
+    """
     model.eval()
 
     if device is not None:
@@ -52,23 +122,372 @@ def pgd_perturbs(
         images = images.to(device)
         labels = labels.to(device)
 
-    original_images = images
+    if init is not None:
+        if n_restarts > 1:
+            raise ValueError("init cannot be used with random restarts")
+        init = init.to(images.device)
 
-    for e in range(n_epoches + 1):
-        images = images.detach()
-        images.requires_grad = True
+    loop = _apgd_loop if adaptive else _pgd_loop
+    with attack_session(model):
+        if n_restarts > 1:
+            perturbs, _, cost = _pgd_restarts(
+                loop,
+                model,
+                criterion,
+                images,
+                labels,
+                epsilon,
+                step_size,
+                n_epoches,
+                early_stop,
+                n_restarts,
+                max_batch_size,
+            )
+        else:
+            perturbs, _, cost = loop(
+                model,
+                criterion,
+                images,
+                labels,
+                epsilon,
+                step_size,
+                n_epoches,
+                early_stop,
+                init=init,
+            )
+
+    if return_result:
+        return AttackResult.evaluate(
+            model, criterion, images, labels, perturbs, **cost
+        )
+    return perturbs
+
+
+def _pgd_loop(
+    model,
+    criterion,
+    images,
+    labels,
+    epsilon,
+    step_size,
+    n_epoches,
+    early_stop,
+    init=None,
+    per_sample=False,
+):
+    """Run PGD iterations and return the perturbations, the per-sample
+    losses at the returned perturbations if `per_sample` is True, and the
+    cost of the attack
+
+    The returned perturbation, `epsilon` times the sign of the last
+    gradient, is a different point from the last iterate, so its loss is
+    measured with one more gradient-free forward pass.
+    """
+    # Projection bounds are computed once: the epsilon-ball around the
+    # original images, intersected with the valid input range
+    lower = torch.clamp(images - epsilon, min=-1)
+    upper = torch.clamp(images + epsilon, max=1)
+    original_images, original_labels = images, labels
+    if init is not None:
+        images = images + init
+    images = images.detach().clone()
+    pgd_project_(images, lower, upper)
+    images.requires_grad = True
+
+    perturbs = torch.zeros_like(images)
+    cost = _new_cost(len(images), images.device)
+    # Indices of the samples still being attacked
+    active = torch.arange(len(images), device=images.device)
 
+    for e in range(n_epoches + 1):
         output = model(images)
+        cost["n_forward"] += 1
+        cost["n_backward"] += 1
 
-        model.zero_grad()
         loss = criterion(output, labels)
-        loss.backward()
+        (grad,) = torch.autograd.grad(loss, images)
 
         if e == n_epoches:
-            return epsilon * torch.sign(images.grad)
+            perturbs[active] = epsilon * torch.sign(grad)
+            cost["n_iterations"][active] = e + 1
+            break
+
+        if early_stop:
+            fooled = output.argmax(dim=1) != labels
+            if fooled.any():
+                # Freeze fallen samples and compact the working batch
+                perturbs[active[fooled]] = epsilon * torch.sign(grad[fooled])
+                cost["n_iterations"][active[fooled]] = e + 1
+                kept = ~fooled
+                if not kept.any():
+                    break
+                active = active[kept]
+                images = images.detach()[kept].requires_grad_()
+                lower = lower[kept]
+                upper = upper[kept]
+                labels = labels[kept]
+                grad = grad[kept]
+
+        with torch.no_grad():
+            pgd_step_(images, grad, step_size, lower, upper)
+
+    losses = None
+    if per_sample:
+        adversarial = torch.clamp(original_images + perturbs, min=-1, max=1)
+        with torch.no_grad():
+            losses = unreduced_criterion(criterion)(
+                model(adversarial), original_labels
+            )
+        cost["n_forward"] += 1
+    return perturbs, losses, cost
+
+
+def _apgd_loop(
+    model,
+    criterion,
+    images,
+    labels,
+    epsilon,
+    step_size,
+    n_epoches,
+    early_stop,
+    init=None,
+    per_sample=False,
+    momentum=0.75,
+    rho=0.75,
+):
+    """Run Auto-PGD iterations and return the best perturbations, their
+    per-sample losses if `per_sample` is True, and the cost of the attack
+
+    Step sizes are checked at checkpoints spaced as in Croce & Hein (2020).
+    A sample's step size is halved, and its iterate reset to its best point,
+    if its loss increased in less than `rho` of the steps since the last
+    checkpoint, or if neither its step size nor its best loss changed since
+    then.
+    """
+    sample_criterion = unreduced_criterion(criterion)
+    n_samples = len(images)
+    shape = (-1,) + (1,) * (images.dim() - 1)
+
+    lower = torch.clamp(images - epsilon, min=-1)
+    upper = torch.clamp(images + epsilon, max=1)
+    original_images = images
+    if init is not None:
+        images = images + init
+    x = images.detach().clone()
+    pgd_project_(x, lower, upper)
+
+    cost = _new_cost(n_samples, x.device)
 
-        images = images + (step_size * torch.sign(images.grad))
-        images = torch.max(
-            torch.min(images, original_images + epsilon),
-            original_images - epsilon,
+    def evaluate(x):
+        cost["n_forward"] += 1
+        cost["n_backward"] += 1
+        x = x.detach().requires_grad_()
+        output = model(x)
+        loss = sample_criterion(output, labels)
+        (grad,) = torch.autograd.grad(loss.sum(), x)
+        return output.detach(), loss.detach(), grad
+
+    output, loss, grad = evaluate(x)
+    best_x, best_loss, best_grad = x.clone(), loss.clone(), grad.clone()
+    x_prev = x.clone()
+    eta = torch.full((n_samples,), 2 * epsilon, device=x.device)
+    eta_checkpoint = eta.clone()
+    best_loss_checkpoint = best_loss.clone()
+    n_increases = torch.zeros(n_samples, device=x.device)
+    checkpoints = _apgd_checkpoints(n_epoches)
+    last_checkpoint = 0
+
+    perturbs = torch.zeros_like(x)
+    losses = torch.zeros(n_samples, device=x.device)
+    # Indices of the samples still being attacked
+    active = torch.arange(n_samples, device=x.device)
+
+    for k in range(n_epoches + 1):
+        if early_stop:
+            fooled = output.argmax(dim=1) != labels
+            if fooled.any():
+                # Freeze fallen samples at their current iterate and compact
+                # the working batch
+                perturbs[active[fooled]] = (x - original_images)[fooled]
+                losses[active[fooled]] = loss[fooled]
+                cost["n_iterations"][active[fooled]] = k + 1
+                kept = ~fooled
+                if not kept.any():
+                    break
+                active = active[kept]
+                (
+                    x,
+                    x_prev,
+                    grad,
+                    loss,
+                    best_x,
+                    best_loss,
+                    best_grad,
+                    eta,
+                    eta_checkpoint,
+                    best_loss_checkpoint,
+                    n_increases,
+                    original_images,
+                    lower,
+                    upper,
+                    labels,
+                ) = (
+                    t[kept]
+                    for t in (
+                        x,
+                        x_prev,
+                        grad,
+                        loss,
+                        best_x,
+                        best_loss,
+                        best_grad,
+                        eta,
+                        eta_checkpoint,
+                        best_loss_checkpoint,
+                        n_increases,
+                        original_images,
+                        lower,
+                        upper,
+                        labels,
+                    )
+                )
+        if k == n_epoches:
+            perturbs[active] = best_x - original_images
+            losses[active] = best_loss
+            cost["n_iterations"][active] = k + 1
+            break
+
+        # Step with momentum
+        z = x + eta.view(shape) * torch.sign(grad)
+        pgd_project_(z, lower, upper)
+        if k > 0:
+            z = x + momentum * (z - x) + (1 - momentum) * (x - x_prev)
+            pgd_project_(z, lower, upper)
+        x_prev, x = x, z
+
+        previous_loss = loss
+        output, loss, grad = evaluate(x)
+        n_increases += (loss > previous_loss).float()
+        improved = loss > best_loss
+        best_x[improved] = x[improved]
+        best_loss[improved] = loss[improved]
+        best_grad[improved] = grad[improved]
+
+        if k + 1 in checkpoints:
+            stalled = n_increases < rho * (k + 1 - last_checkpoint)
+            stalled |= (eta == eta_checkpoint) & (
+                best_loss == best_loss_checkpoint
+            )
+            eta_checkpoint = eta.clone()
+            best_loss_checkpoint = best_loss.clone()
+            eta[stalled] /= 2
+            # Restart stalled samples from their best point
+            x[stalled] = best_x[stalled]
+            grad[stalled] = best_grad[stalled]
+            n_increases.zero_()
+            last_checkpoint = k + 1
+
+    return perturbs, (losses if per_sample else None), cost
+
+
+def _apgd_checkpoints(n_epoches):
+    """Iterations at which Auto-PGD step sizes are checked"""
+    p = [0, 0.22]
+    while p[-1] < 1:
+        p.append(p[-1] + max(p[-1] - p[-2] - 0.03, 0.06))
+    return {math.ceil(n_epoches * q) for q in p[1:-1]}
+
+
+def pgd_step_(images, grad, step_size, lower, upper):
+    """Fused PGD step, done in place without temporaries
+
+    `images` is moved by `step_size` along the sign of `grad` and projected
+    back between `lower` and `upper`. `grad` is overwritten with its sign.
+    """
+    torch.sign(grad, out=grad)
+    images.add_(grad, alpha=step_size)
+    pgd_project_(images, lower, upper)
+
+
+def pgd_project_(images, lower, upper):
+    """Project `images` between `lower` and `upper` in place"""
+    torch.max(images, lower, out=images)
+    torch.min(images, upper, out=images)
+
+
+def _pgd_restarts(
+    loop,
+    model,
+    criterion,
+    images,
+    labels,
+    epsilon,
+    step_size,
+    n_epoches,
+    early_stop,
+    n_restarts,
+    max_batch_size,
+):
+    n_samples = len(images)
+    if max_batch_size is None:
+        chunk_size = n_restarts
+    else:
+        chunk_size = max(1, max_batch_size // n_samples)
+
+    best_perturbs = torch.zeros_like(images)
+    cost = _new_cost(n_samples, images.device)
+    best_losses = torch.full((n_samples,), -float("inf"), device=images.device)
+    sample_idx = torch.arange(n_samples, device=images.device)
+    repeats = [1] * (images.dim() - 1)
+
+    for start in range(0, n_restarts, chunk_size):
+        n_chunk = min(chunk_size, n_restarts - start)
+        # Fold restarts into the batch dimension: (R * B, ...)
+        wide_images = images.repeat(n_chunk, *repeats)
+        wide_labels = labels.repeat(n_chunk)
+        init = torch.empty_like(wide_images).uniform_(-epsilon, epsilon)
+
+        perturbs, losses, chunk_cost = loop(
+            model,
+            criterion,
+            wide_images,
+            wide_labels,
+            epsilon,
+            step_size,
+            n_epoches,
+            early_stop,
+            init=init,
+            per_sample=True,
         )
+        perturbs = perturbs.view(n_chunk, *images.shape)
+        losses = losses.view(n_chunk, n_samples)
+        _add_cost(cost, chunk_cost, n_chunk)
+
+        chunk_losses, chunk_idx = losses.max(dim=0)
+        chunk_perturbs = perturbs[chunk_idx, sample_idx]
+        better = chunk_losses > best_losses
+        best_perturbs[better] = chunk_perturbs[better]
+        best_losses[better] = chunk_losses[better]
+
+    return best_perturbs, best_losses, cost
+
+
+def _new_cost(n_samples, device):
+    """Counters of gradient evaluations per sample, and of forward and
+    backward passes of the model"""
+    return {
+        "n_iterations": torch.zeros(
+            n_samples, dtype=torch.long, device=device
+        ),
+        "n_forward": 0,
+        "n_backward": 0,
+    }
+
+
+def _add_cost(cost, other, n_restarts=1):
+    """Accumulate `other` into `cost`, summing the iterations of restarts
+    folded into the batch dimension"""
+    cost["n_iterations"] += other["n_iterations"].view(n_restarts, -1).sum(0)
+    cost["n_forward"] += other["n_forward"]
+    cost["n_backward"] += other["n_backward"]
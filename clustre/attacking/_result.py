@@ -0,0 +1,88 @@
+import torch
+
+from clustre.attacking._utils import unreduced_criterion
+
+
+class AttackResult:
+    """Outcome of an attack on a batch
+
+    Attributes
+    ----------
+    adversarial: torch.Tensor
+        Attacked images, clamped to the valid input range
+    perturbs: torch.Tensor
+        Perturbations added to the images
+    logits: torch.Tensor
+        Output of the model on the attacked images
+    loss: torch.Tensor
+        Per-sample loss on the attacked images
+    success: torch.Tensor
+        Boolean mask of the samples misclassified after the attack
+    n_iterations: torch.Tensor
+        Gradient evaluations spent on each sample
+    n_forward: int
+        Forward passes of the model, including the evaluation of the
+        attacked images
+    n_backward: int
+        Backward passes of the model
+    """
+
+    def __init__(
+        self,
+        adversarial,
+        perturbs,
+        logits,
+        loss,
+        success,
+        n_iterations,
+        n_forward,
+        n_backward,
+    ):
+        self.adversarial = adversarial
+        self.perturbs = perturbs
+        self.logits = logits
+        self.loss = loss
+        self.success = success
+        self.n_iterations = n_iterations
+        self.n_forward = n_forward
+        self.n_backward = n_backward
+
+    @property
+    def predictions(self):
+        return self.logits.argmax(dim=1)
+
+    @classmethod
+    def evaluate(
+        cls,
+        model,
+        criterion,
+        images,
+        labels,
+        perturbs,
+        n_iterations,
+        n_forward,
+        n_backward,
+    ):
+        """Build the result of an attack with one gradient-free forward pass
+        on the attacked images"""
+        adversarial = torch.clamp(images + perturbs, min=-1, max=1)
+        with torch.no_grad():
+            logits = model(adversarial)
+            loss = unreduced_criterion(criterion)(logits, labels)
+        return cls(
+            adversarial,
+            perturbs,
+            logits,
+            loss,
+            logits.argmax(dim=1) != labels,
+            n_iterations,
+            n_forward + 1,
+            n_backward,
+        )
+
+    def __repr__(self):
+        return (
+            f"AttackResult(n_samples={len(self.perturbs)}, "
+            f"success_rate={self.success.float().mean().item():.4f}, "
+            f"n_forward={self.n_forward}, n_backward={self.n_backward})"
+        )
@@ -0,0 +1,29 @@
+from contextlib import contextmanager
+
+import torch
+
+
+@contextmanager
+def attack_session(model):
+    """Context in which only gradients with respect to the input are computed
+
+    Parameters of `model` are frozen on entry, so that backward passes during
+    an attack neither compute nor store gradients for the weights. The
+    previous `requires_grad` flags are restored on exit, including when an
+    exception is raised.
+
+    Parameters
+    ----------
+    model: torch.nn.model
+        The model to be attacked
+    """
+    params = list(model.parameters())
+    requires_grad = [p.requires_grad for p in params]
+    try:
+        for p in params:
+            p.requires_grad_(False)
+        with torch.enable_grad():
+            yield model
+    finally:
+        for p, flag in zip(params, requires_grad):
+            p.requires_grad_(flag)
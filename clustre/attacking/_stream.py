@@ -0,0 +1,143 @@
+import threading
+from queue import Queue
+
+import numpy as np
+from torch import nn
+
+from clustre.attacking._fgsm import fgsm_perturbs
+from clustre.attacking._maxloss import maxloss_perturbs
+from clustre.attacking._pgd import pgd_perturbs
+from clustre.helpers import PerturbWriter, ternary_epsilon
+
+ATTACKS = {
+    "fgsm": fgsm_perturbs,
+    "pgd": pgd_perturbs,
+    "maxloss": maxloss_perturbs,
+}
+
+
+def get_attack(attack):
+    """Resolve an attack name to its perturbation function"""
+    if callable(attack):
+        return attack
+    if attack not in ATTACKS:
+        raise NotImplementedError(f"Unknown attack: {attack}")
+    return ATTACKS[attack]
+
+
+def attack_stream(
+    model,
+    loader,
+    attack,
+    criterion=nn.CrossEntropyLoss(),
+    out=None,
+    out_format="npy",
+    prefetch=True,
+    device=None,
+    **params,
+):
+    """Generate perturbations of a whole DataLoader batch by batch
+
+    Only the batch being attacked is held in memory, so perturbations of
+    datasets of any size can be generated with constant memory.
+
+    Parameters
+    ----------
+    model: torch.nn.model
+        The model to be attacked
+    loader: torch.utils.data.DataLoader
+        DataLoader to be attacked. It must not be shuffled if `out` is used,
+        as perturbations are written at the dataset offsets of the batches
+    attack: str or function
+        "fgsm", "pgd", "maxloss" or a perturbation function with the
+        signature of `fgsm_perturbs`
+    criterion: function
+        Criterion function
+    out: str or None
+        If given, path of a file which is preallocated for the whole
+        dataset and memory-mapped. Each batch is written in place
+    out_format: str
+        "npy" for a float32 `.npy` file, or "packed" for the packed
+        perturbation format of `clustre.helpers.save_perturbs`. The packed
+        encoding is chosen from the first batch
+    prefetch: bool
+        If True, the next batch is loaded in a background thread while the
+        current one is being attacked
+    device: torch.device, str, or None
+        Device to be used
+    **params:
+        Parameters to be passed to the attack
+
+    Yields
+    ------
+    torch.Tensor
+        Perturbations of each batch, in the order of the loader
+    """
+    attack = get_attack(attack)
+    batches = _prefetch(loader, device) if prefetch else iter(loader)
+
+    storage = None
+    offset = 0
+    for batch in batches:
+        images, labels = batch[0], batch[1]
+        if device is not None:
+            images = images.to(device)
+            labels = labels.to(device)
+        perturbs = attack(
+            model, criterion, images, labels, device=device, **params
+        ).detach()
+
+        if out is not None:
+            if storage is None:
+                storage = _open_storage(out, out_format, loader, perturbs)
+            if out_format == "packed":
+                storage.write(offset, perturbs)
+            else:
+                storage[offset : offset + len(perturbs)] = (
+                    perturbs.cpu().numpy()
+                )
+        offset += len(perturbs)
+
+        yield perturbs
+
+    if storage is not None:
+        storage.flush()
+        del storage
+
+
+def _open_storage(out, out_format, loader, perturbs):
+    shape = (len(loader.dataset),) + tuple(perturbs.shape[1:])
+    if out_format == "npy":
+        return np.lib.format.open_memmap(
+            out, mode="w+", dtype=np.float32, shape=shape
+        )
+    elif out_format == "packed":
+        return PerturbWriter(out, shape, ternary_epsilon(perturbs))
+    else:
+        raise NotImplementedError(f"Unknown output format: {out_format}")
+
+
+def _prefetch(loader, device=None):
+    """Iterate over `loader` with the next batch loaded in a background
+    thread"""
+    queue = Queue(maxsize=1)
+    done = object()
+
+    def load():
+        try:
+            for batch in loader:
+                if device is not None:
+                    batch = [x.to(device, non_blocking=True) for x in batch]
+                queue.put(batch)
+        except Exception as e:
+            queue.put(e)
+        queue.put(done)
+
+    threading.Thread(target=load, daemon=True).start()
+    while True:
+        batch = queue.get()
+        if batch is done:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
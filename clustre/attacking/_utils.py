@@ -0,0 +1,13 @@
+import copy
+
+
+def unreduced_criterion(criterion):
+    """Return a copy of `criterion` which returns one loss per sample"""
+    if not hasattr(criterion, "reduction"):
+        raise ValueError(
+            "Per-sample losses require a criterion with a `reduction` "
+            "attribute, e.g. nn.CrossEntropyLoss()"
+        )
+    criterion = copy.copy(criterion)
+    criterion.reduction = "none"
+    return criterion
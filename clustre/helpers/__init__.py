@@ -1,3 +1,16 @@
+from clustre.helpers._hashing import (
+    hash_dataset,
+    hash_params,
+    hash_state_dict,
+)
+from clustre.helpers._lru import DiskLRU
+from clustre.helpers._perturbs import (
+    PerturbReader,
+    PerturbWriter,
+    load_perturbs,
+    save_perturbs,
+    ternary_epsilon,
+)
 from clustre.helpers._time import (
     delta_time_string,
     delta_tostr,
@@ -0,0 +1,41 @@
+import hashlib
+import json
+
+
+def hash_state_dict(model):
+    """Hash of the parameters and buffers of a model or a state dict"""
+    state = model.state_dict() if hasattr(model, "state_dict") else model
+    h = hashlib.sha1()
+    for key in sorted(state):
+        h.update(key.encode())
+        h.update(state[key].detach().cpu().numpy().tobytes())
+    return h.hexdigest()
+
+
+def hash_dataset(dataset, indices=None):
+    """Hash identifying a dataset and, optionally, a subset of its samples
+
+    Datasets holding tensors, such as `TensorDataset`, are hashed by their
+    contents. Other datasets are identified by their representation, which
+    for torchvision datasets includes the root, the split and the transform.
+    """
+    h = hashlib.sha1()
+    if hasattr(dataset, "indices") and hasattr(dataset, "dataset"):
+        # torch.utils.data.Subset
+        h.update(hash_dataset(dataset.dataset, dataset.indices).encode())
+    elif hasattr(dataset, "tensors"):
+        for tensor in dataset.tensors:
+            h.update(tensor.detach().cpu().numpy().tobytes())
+    else:
+        h.update(type(dataset).__name__.encode())
+        h.update(repr(dataset).encode())
+    h.update(str(len(dataset)).encode())
+    if indices is not None:
+        h.update(json.dumps([int(i) for i in indices]).encode())
+    return h.hexdigest()
+
+
+def hash_params(params):
+    """Hash of a dictionary of parameters"""
+    encoded = json.dumps(params, sort_keys=True, default=repr)
+    return hashlib.sha1(encoded.encode()).hexdigest()
@@ -0,0 +1,77 @@
+import os
+import shutil
+
+
+class DiskLRU:
+    """Directory of entries evicted in least recently used order
+
+    Entries are the files or directories of `root` whose name ends with
+    `suffix`. Their modification time records when they were last used, and
+    once their total size grows over `max_size` bytes, the least recently
+    used ones are removed.
+
+    Parameters
+    ----------
+    root: str
+        Directory of the entries
+    max_size: int
+        Maximum total size of the entries, in bytes
+    """
+
+    suffix = ""
+
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key + self.suffix)
+
+    def touch(self, path):
+        """Mark an entry as recently used"""
+        os.utime(path)
+
+    def size(self):
+        return sum(self._entry_size(path) for path in self._entries())
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the directory fits
+        in `max_size`, except for `keep`"""
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        sizes = {path: self._entry_size(path) for path in entries}
+        total = sum(sizes.values())
+        for path in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            total -= sizes[path]
+            self._remove(path)
+
+    def clear(self):
+        for path in self._entries():
+            self._remove(path)
+
+    def _entries(self):
+        return [
+            os.path.join(self.root, name)
+            for name in os.listdir(self.root)
+            if name.endswith(self.suffix)
+        ]
+
+    @staticmethod
+    def _entry_size(path):
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        return sum(
+            os.path.getsize(os.path.join(path, name))
+            for name in os.listdir(path)
+        )
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
@@ -0,0 +1,230 @@
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"CLSTRPRT"
+ALIGNMENT = 64
+TERNARY = "ternary"
+FLOAT16 = "float16"
+
+
+def _to_numpy(perturbs):
+    if hasattr(perturbs, "detach"):
+        perturbs = perturbs.detach().cpu().numpy()
+    return np.asarray(perturbs)
+
+
+def ternary_epsilon(perturbs):
+    """Return epsilon if every element of `perturbs` is one of -epsilon, 0
+    and epsilon, as with FGSM and PGD perturbations, otherwise None"""
+    perturbs = _to_numpy(perturbs)
+    magnitude = np.abs(perturbs)
+    epsilon = magnitude.max() if perturbs.size else 0.0
+    if epsilon == 0:
+        return None
+    if np.all((magnitude == 0) | (magnitude == epsilon)):
+        return float(epsilon)
+    return None
+
+
+def _pack(perturbs, row_bytes):
+    """Pack ternary perturbations into 2 bits per element"""
+    n = len(perturbs)
+    flat = perturbs.reshape(n, -1)
+    codes = np.zeros((n, row_bytes * 4), dtype=np.uint8)
+    codes[:, : flat.shape[1]][flat > 0] = 1
+    codes[:, : flat.shape[1]][flat < 0] = 2
+    codes = codes.reshape(n, row_bytes, 4)
+    return (
+        codes[..., 0]
+        | (codes[..., 1] << 2)
+        | (codes[..., 2] << 4)
+        | (codes[..., 3] << 6)
+    )
+
+
+def _unpack_table(epsilon):
+    """Lookup table from a packed byte to its 4 unpacked elements"""
+    values = np.array([0, epsilon, -epsilon, 0], dtype=np.float32)
+    byte = np.arange(256)
+    return np.stack([values[(byte >> s) & 3] for s in (0, 2, 4, 6)], axis=1)
+
+
+class PerturbWriter:
+    """Preallocated perturbation file to be written batch by batch
+
+    Ternary perturbations (every element in {-epsilon, 0, epsilon}) are
+    bit-packed at 2 bits per element with epsilon stored in the header.
+    Other perturbations, such as maxloss ones, are stored as float16.
+
+    Parameters
+    ----------
+    path: str
+        Path of the file to be created
+    shape: tuple
+        Shape of the whole perturbation array, (n_samples, ...)
+    epsilon: float or None
+        If float, perturbations are stored as ternary with this bound.
+        If None, perturbations are stored as float16
+    """
+
+    def __init__(self, path, shape, epsilon=None):
+        self.path = path
+        self.shape = tuple(int(s) for s in shape)
+        self.epsilon = epsilon
+        self.encoding = FLOAT16 if epsilon is None else TERNARY
+        header = {
+            "encoding": self.encoding,
+            "shape": list(self.shape),
+            "epsilon": epsilon,
+        }
+        self.offset, row = _write_header(path, header)
+        self.data = np.memmap(
+            path,
+            dtype=np.uint8 if self.encoding == TERNARY else np.float16,
+            mode="r+",
+            offset=self.offset,
+            shape=(self.shape[0], row),
+        )
+
+    def write(self, offset, perturbs):
+        """Write `perturbs` at sample `offset`"""
+        perturbs = _to_numpy(perturbs)
+        n = len(perturbs)
+        if self.encoding == TERNARY:
+            magnitude = np.abs(perturbs)
+            if not np.all(
+                (magnitude == 0) | np.isclose(magnitude, self.epsilon)
+            ):
+                raise ValueError(
+                    f"Perturbations are not ternary with epsilon {self.epsilon}"
+                )
+            self.data[offset : offset + n] = _pack(
+                perturbs, self.data.shape[1]
+            )
+        else:
+            self.data[offset : offset + n] = perturbs.reshape(n, -1)
+
+    def flush(self):
+        self.data.flush()
+
+    def close(self):
+        self.flush()
+        del self.data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PerturbReader:
+    """Lazy memory-mapped reader of a perturbation file
+
+    Only the indexed samples are read and unpacked, as float32.
+
+    Parameters
+    ----------
+    path: str
+        Path of a file written by `save_perturbs` or `PerturbWriter`
+    """
+
+    def __init__(self, path):
+        self.path = path
+        header, self.offset, row = _read_header(path)
+        self.encoding = header["encoding"]
+        self.shape = tuple(header["shape"])
+        self.epsilon = header["epsilon"]
+        self.data = np.memmap(
+            path,
+            dtype=np.uint8 if self.encoding == TERNARY else np.float16,
+            mode="r",
+            offset=self.offset,
+            shape=(self.shape[0], row),
+        )
+        if self.encoding == TERNARY:
+            self._table = _unpack_table(self.epsilon)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        rows = self.data[idx]
+        single = rows.ndim == 1
+        if single:
+            rows = rows[None]
+        if self.encoding == TERNARY:
+            n_elements = int(np.prod(self.shape[1:]))
+            values = self._table[rows].reshape(len(rows), -1)[:, :n_elements]
+        else:
+            values = rows.astype(np.float32)
+        values = values.reshape((len(rows),) + self.shape[1:])
+        return values[0] if single else values
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+
+def save_perturbs(path, perturbs, epsilon=None):
+    """Save perturbations in the packed perturbation format
+
+    Parameters
+    ----------
+    path: str
+        Path of the file to be written
+    perturbs: numpy.ndarray or torch.Tensor
+        Perturbations of shape (n_samples, ...)
+    epsilon: float or None
+        Perturbation bound of ternary perturbations. If None, it is
+        detected from `perturbs`, falling back to float16 storage
+    """
+    perturbs = _to_numpy(perturbs)
+    if epsilon is None:
+        epsilon = ternary_epsilon(perturbs)
+    with PerturbWriter(path, perturbs.shape, epsilon) as writer:
+        writer.write(0, perturbs)
+
+
+def load_perturbs(path):
+    """Open a perturbation file lazily. Use `np.asarray` on the result to
+    load every perturbation at once"""
+    return PerturbReader(path)
+
+
+def _row_size(header):
+    n_elements = int(np.prod(header["shape"][1:]))
+    if header["encoding"] == TERNARY:
+        return -(-n_elements // 4), 1
+    return n_elements, 2
+
+
+def _write_header(path, header):
+    encoded = json.dumps(header).encode()
+    offset = len(MAGIC) + 4 + len(encoded)
+    offset += -offset % ALIGNMENT
+    row, itemsize = _row_size(header)
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(encoded)))
+        f.write(encoded)
+        f.truncate(offset + header["shape"][0] * row * itemsize)
+    return offset, row
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a perturbation file")
+        (length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length).decode())
+    offset = len(MAGIC) + 4 + length
+    offset += -offset % ALIGNMENT
+    row, _ = _row_size(header)
+    return header, offset, row
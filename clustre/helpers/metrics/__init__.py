@@ -1,8 +1,9 @@
+import numpy as np
 import torch
 from sklearn.metrics import classification_report as cf
 from torch import nn
 
-from clustre.attacking import fgsm, pgd
+from clustre.attacking import fgsm, get_attack, pgd
 
 
 def classification_report(model, testloader, device=None):
@@ -32,16 +33,17 @@ def classification_report_fgsm(model, testloader, device=None, fgsm_params={}):
         if device is not None:
             images = images.to(device)
             labels = labels.to(device)
-        attacked_images = fgsm(
+        result = fgsm(
             model,
             nn.CrossEntropyLoss(),
             images,
             labels,
             device=device,
+            return_result=True,
             **fgsm_params
         )
         y_true.append(labels)
-        y_pred.append(model(attacked_images))
+        y_pred.append(result.logits)
     y_true = torch.cat(y_true)
     y_pred = torch.cat(y_pred)
     y_pred = y_pred.argmax(dim=1)
@@ -58,18 +60,93 @@ def classification_report_pgd(model, testloader, device=None, pgd_params={}):
         if device is not None:
             images = images.to(device)
             labels = labels.to(device)
-        attacked_images = pgd(
+        result = pgd(
             model,
             nn.CrossEntropyLoss(),
             images,
             labels,
             device=device,
+            return_result=True,
             **pgd_params
         )
         y_true.append(labels)
-        y_pred.append(model(attacked_images))
+        y_pred.append(result.logits)
     y_true = torch.cat(y_true)
     y_pred = torch.cat(y_pred)
     y_pred = y_pred.argmax(dim=1)
 
     return cf(y_true.cpu().numpy(), y_pred.cpu().numpy())
+
+
+def transfer_matrix(
+    sources,
+    targets,
+    loader,
+    attacks,
+    criterion=nn.CrossEntropyLoss(),
+    device=None,
+):
+    """Accuracy of target models on adversarial examples of source models
+
+    Every batch is loaded once and attacked once per source model, and all
+    target models are evaluated on the adversarial batch while it is still
+    in memory.
+
+    Parameters
+    ----------
+    sources: dict of str to torch.nn.model
+        Models the adversarial examples are generated from
+    targets: dict of str to torch.nn.model
+        Models to be evaluated
+    loader: torch.utils.data.DataLoader
+        DataLoader to be attacked
+    attacks: dict
+        Map from an attack name to either an attack ("fgsm", "pgd",
+        "maxloss" or a perturbation function), or a tuple of an attack and
+        a dict of its parameters
+    criterion: function
+        Criterion function
+    device: torch.device, str, or None
+        Device to be used
+
+    Returns
+    -------
+    dict of str to numpy.ndarray
+        Map from an attack name to the accuracy matrix, with a row for each
+        source model and a column for each target model, in the order of
+        `sources` and `targets`
+    """
+    attacks = {
+        name: attack if isinstance(attack, tuple) else (attack, {})
+        for name, attack in attacks.items()
+    }
+    sources = list(sources.values())
+    targets = list(targets.values())
+    for model in sources + targets:
+        model.eval()
+        if device is not None:
+            model.to(device)
+
+    correct = {
+        name: np.zeros((len(sources), len(targets))) for name in attacks
+    }
+    total = 0
+    for batch in loader:
+        images, labels = batch[0], batch[1]
+        if device is not None:
+            images = images.to(device)
+            labels = labels.to(device)
+        for name, (attack, params) in attacks.items():
+            attack = get_attack(attack)
+            for i, source in enumerate(sources):
+                perturbs = attack(
+                    source, criterion, images, labels, device=device, **params
+                )
+                attacked_images = torch.clamp(images + perturbs, min=-1, max=1)
+                with torch.no_grad():
+                    for j, target in enumerate(targets):
+                        y_pred = target(attacked_images).argmax(dim=1)
+                        correct[name][i, j] += (y_pred == labels).sum().item()
+        total += len(labels)
+
+    return {name: c / total for name, c in correct.items()}
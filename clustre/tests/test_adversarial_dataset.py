@@ -0,0 +1,85 @@
+# %%
+import unittest
+
+# %%
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import TensorDataset
+
+# %%
+from clustre.adversarial_training._cluster import (
+    AdversarialDataset,
+    KMeansWrapper,
+    materialize,
+)
+from clustre.adversarial_training._sampler import ClusterBatchSampler
+
+# %%
+torch.manual_seed(0)
+model = nn.Sequential(nn.Flatten(), nn.Linear(16, 10))
+X = torch.rand(100, 1, 4, 4) * 2 - 1
+y = torch.randint(0, 10, (100,))
+dataset = TensorDataset(X, y)
+features = X.reshape(100, -1).numpy()
+km = KMeansWrapper(features, 8, n_init=1, method="cpu")
+
+
+def make_dataset(tensor_backed):
+    return AdversarialDataset(
+        model, dataset, km=km, device="cpu", tensor_backed=tensor_backed
+    )
+
+
+# %%
+class TestAdversarialDataset(unittest.TestCase):
+    def test_materialize(self):
+        data, targets = materialize(dataset, batch_size=32)
+        self.assertTrue(torch.equal(data, X))
+        self.assertTrue(torch.equal(targets, y))
+        self.assertEqual(targets.dtype, torch.long)
+
+    def test_centroids(self):
+        per_sample = make_dataset(False)
+        tensor_backed = make_dataset(True)
+        self.assertTrue(
+            torch.equal(per_sample.centroids_X, tensor_backed.centroids_X)
+        )
+        self.assertTrue(
+            torch.equal(per_sample.centroids_y, tensor_backed.centroids_y)
+        )
+
+    def test_loader(self):
+        per_sample = make_dataset(False)
+        tensor_backed = make_dataset(True)
+        samplers = [
+            lambda: None,
+            lambda: ClusterBatchSampler(km.y_pred, batch_size=16, seed=0),
+        ]
+        for make_sampler in samplers:
+            sampler = make_sampler()
+            if sampler is None:
+                idx = np.arange(100)
+            else:
+                idx = np.concatenate(list(sampler))
+            for ds in [per_sample, tensor_backed]:
+                batches = list(
+                    ds.loader(batch_size=16, batch_sampler=make_sampler())
+                )
+                self.assertEqual(len(batches), 7)
+                images, targets, cluster_ids = (
+                    torch.cat(t) for t in zip(*batches)
+                )
+                # Batches gathered from tensors match the per-sample path
+                self.assertTrue(torch.equal(images, X[idx]))
+                self.assertTrue(torch.equal(targets, y[idx]))
+                self.assertTrue(
+                    np.array_equal(
+                        np.asarray(cluster_ids), km.y_pred[idx].astype(int)
+                    )
+                )
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# %%
+import tempfile
+import unittest
+
+# %%
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import TensorDataset
+
+# %%
+from clustre.attacking import PerturbCache, fgsm_perturbs
+
+# %%
+torch.manual_seed(0)
+model = nn.Sequential(nn.Flatten(), nn.Linear(16, 10))
+dataset = TensorDataset(
+    torch.rand(40, 1, 4, 4) * 2 - 1, torch.randint(0, 10, (40,))
+)
+n_calls = 0
+
+
+def counted_fgsm_perturbs(*args, **kwargs):
+    global n_calls
+    n_calls += 1
+    return fgsm_perturbs(*args, **kwargs)
+
+
+# %%
+class TestPerturbCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = PerturbCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hit(self):
+        global n_calls
+        n_calls = 0
+        first = self.cache.perturbs(
+            model, dataset, counted_fgsm_perturbs, batch_size=16
+        )
+        self.assertEqual(n_calls, 3)
+        second = self.cache.perturbs(
+            model, dataset, counted_fgsm_perturbs, batch_size=16
+        )
+        # Served from disk without attacking again
+        self.assertEqual(n_calls, 3)
+        self.assertTrue(np.array_equal(first[:], second[:]))
+
+    def test_miss(self):
+        self.cache.perturbs(model, dataset, "fgsm", epsilon=0.3)
+        self.cache.perturbs(model, dataset, "fgsm", epsilon=0.1)
+        self.assertEqual(len(self.cache._entries()), 2)
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# %%
+import unittest
+
+# %%
+import torch
+from torch import nn
+
+# %%
+from clustre.attacking import pgd_perturbs
+
+# %%
+torch.manual_seed(0)
+model = nn.Sequential(
+    nn.Flatten(), nn.Linear(16, 32), nn.ReLU(), nn.Linear(32, 10)
+)
+X = torch.rand(64, 1, 4, 4) * 2 - 1
+# Half of the samples start correctly classified, half misclassified
+with torch.no_grad():
+    predictions = model(X).argmax(dim=1)
+y = torch.where(torch.arange(64) % 2 == 0, predictions, (predictions + 1) % 10)
+N_EPOCHES = 20
+
+
+def attack(**params):
+    return pgd_perturbs(
+        model,
+        nn.CrossEntropyLoss(),
+        X,
+        y,
+        epsilon=0.1,
+        n_epoches=N_EPOCHES,
+        return_result=True,
+        **params,
+    )
+
+
+# %%
+class TestEarlyStop(unittest.TestCase):
+    def test_early_stop_shape(self):
+        result = attack(early_stop=True)
+        self.assertTupleEqual(result.perturbs.shape, X.shape)
+
+    def test_early_stop_bound(self):
+        result = attack(early_stop=True)
+        self.assertTrue((result.perturbs.abs() <= 0.1 + 1e-6).all())
+
+    def test_early_stop_iterations(self):
+        full = attack()
+        self.assertTrue((full.n_iterations == N_EPOCHES + 1).all())
+
+        result = attack(early_stop=True)
+        # Samples misclassified from the start are frozen at once
+        self.assertTrue((result.n_iterations[1::2] == 1).all())
+        # Some of the others are fooled along the way and stop early
+        fooled = result.n_iterations[::2] < N_EPOCHES + 1
+        self.assertTrue(fooled.any())
+        self.assertFalse(fooled.all())
+        self.assertLess(result.n_iterations.sum(), full.n_iterations.sum())
+
+    def test_early_stop_unfooled_perturbs(self):
+        # Samples never fooled follow the same iterates as without early
+        # stopping
+        full = attack()
+        result = attack(early_stop=True)
+        never_fooled = result.n_iterations == N_EPOCHES + 1
+        self.assertTrue(never_fooled.any())
+        self.assertTrue(
+            torch.equal(
+                result.perturbs[never_fooled], full.perturbs[never_fooled]
+            )
+        )
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+# %%
+import unittest
+
+# %%
+import torch
+from torch import nn
+from torch.utils.data import TensorDataset
+
+# %%
+from clustre.adversarial_training import extract_features
+from clustre.adversarial_training._features import embeddings
+from clustre.models import mnist_cnn
+
+# %%
+torch.manual_seed(0)
+X = torch.rand(10, 1, 28, 28) * 2 - 1
+y = torch.randint(0, 10, (10,))
+
+
+# %%
+class TestEmbeddings(unittest.TestCase):
+    def test_embeddings_shape(self):
+        # Input of the last layer of MnistCnn, fc3
+        features = embeddings(mnist_cnn, nn.CrossEntropyLoss(), X, y)
+        self.assertTupleEqual(features.shape, (10, 84))
+        self.assertFalse(features.requires_grad)
+
+    def test_extract_embeddings(self):
+        features = extract_features(
+            mnist_cnn, TensorDataset(X, y), "embedding", batch_size=4
+        )
+        self.assertTupleEqual(features.shape, (10, 84))
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
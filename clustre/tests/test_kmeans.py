@@ -0,0 +1,167 @@
+# %%
+import os
+import tempfile
+import unittest
+
+# %%
+import numpy as np
+
+# %%
+from clustre.adversarial_training._cluster import KMeansWrapper
+from clustre.adversarial_training._kmeans import (
+    MiniBatchKMeans,
+    allocate_clusters,
+    assign,
+    hierarchical_kmeans,
+    kmeans,
+    kmeans_sweep,
+    medoids,
+)
+from clustre.adversarial_training._sampler import ClusterBatchSampler
+
+# %%
+rng = np.random.RandomState(0)
+X = rng.normal(size=(500, 16)).astype(np.float32)
+y_pred = rng.randint(0, 20, size=500)
+# Cluster 20 is left empty
+centers = rng.normal(size=(21, 16)).astype(np.float32)
+
+
+def make_blobs(seed=0):
+    """16 well-separated blobs of 30 samples, in blob order"""
+    blobs = np.repeat(np.eye(16, dtype=np.float32) * 10, 30, axis=0)
+    blobs += np.random.RandomState(seed).normal(scale=0.1, size=blobs.shape)
+    return blobs
+
+
+# %%
+class TestKMeans(unittest.TestCase):
+    def test_medoids(self):
+        centroids_idxs, inertia = medoids(X, y_pred, centers, chunk_size=64)
+        for i in range(20):
+            idx = np.flatnonzero(y_pred == i)
+            norm = np.linalg.norm(X[idx] - centers[i], axis=1)
+            self.assertEqual(centroids_idxs[i], idx[norm.argmin()])
+        self.assertEqual(centroids_idxs[20], 0)
+        norm = np.linalg.norm(X - centers[y_pred], axis=1)
+        self.assertAlmostEqual(inertia, norm.sum(), places=2)
+
+    def test_assign(self):
+        y, distances = assign(X, centers, chunk_size=64)
+        d = np.square(X[:, None] - centers[None]).sum(axis=2)
+        self.assertTrue(np.array_equal(y, d.argmin(axis=1)))
+        self.assertTrue(np.allclose(distances, d.min(axis=1), atol=1e-3))
+
+    def test_kmeans(self):
+        # Well-separated blobs are recovered exactly
+        blobs = make_blobs()
+        for init in ["k-means||", "k-means++"]:
+            centers, y = kmeans(blobs, 16, init=init, seed=0, chunk_size=64)
+            self.assertEqual(centers.shape, (16, 16))
+            y = y.reshape(16, 30)
+            self.assertTrue(np.all(y == y[:, :1]))
+            self.assertEqual(len(np.unique(y)), 16)
+
+    def test_best_restart(self):
+        # The restart of the lowest inertia is kept
+        km = KMeansWrapper(X, 20, n_init=4, method="cpu")
+        inertias = []
+        for seed in range(4):
+            restart_centers, restart_y = kmeans(X, 20, seed=seed)
+            inertias.append(medoids(X, restart_y, restart_centers)[1])
+        self.assertGreater(len(set(inertias)), 1)
+        self.assertAlmostEqual(km.inertia, min(inertias), places=3)
+
+    def test_hierarchical_kmeans(self):
+        blobs = make_blobs()
+        for branching in [None, 2]:
+            centers, y = hierarchical_kmeans(
+                blobs, 16, branching=branching, seed=0, chunk_size=64
+            )
+            self.assertEqual(centers.shape, (16, 16))
+            self.assertEqual(len(np.unique(y)), 16)
+            self.assertTrue(np.allclose(centers[y], blobs, atol=1))
+
+    def test_kmeans_sweep(self):
+        blobs = make_blobs()
+        results = kmeans_sweep(blobs, [16, 4, 8], seed=0, chunk_size=64)
+        self.assertEqual(sorted(results), [4, 8, 16])
+        for k, (centers, y) in results.items():
+            self.assertEqual(centers.shape, (k, 16))
+            self.assertEqual(len(np.unique(y)), k)
+
+    def test_allocate_clusters(self):
+        self.assertEqual(list(allocate_clusters([5, 4, 1], 10)), [5, 4, 1])
+        self.assertEqual(list(allocate_clusters([1, 1, 1], 10)), [4, 3, 3])
+        sizes = allocate_clusters([100, 1, 1], 10, max_sizes=[100, 2, 3])
+        self.assertEqual(list(sizes), [8, 1, 1])
+
+    def test_partitioned(self):
+        blobs = make_blobs()
+        labels = np.arange(len(blobs)) % 2
+        km = KMeansWrapper.partitioned(blobs, labels, 32, 1, "cpu")
+        self.assertEqual(len(np.unique(km.y_pred)), 32)
+        # Clusters never mix labels
+        medoid_labels = labels[km.centroids_idxs]
+        self.assertTrue(np.array_equal(medoid_labels[km.y_pred], labels))
+
+    def test_minibatch_kmeans(self):
+        blobs = make_blobs()
+        blobs = blobs[np.random.RandomState(0).permutation(len(blobs))]
+        km = MiniBatchKMeans(16, seed=0)
+        for start in range(0, len(blobs), 50):
+            km.partial_fit(blobs[start : start + 50])
+        y = km.predict(blobs)
+        self.assertEqual(len(np.unique(y)), 16)
+        self.assertTrue(np.allclose(km.centers[y], blobs, atol=1))
+
+    def test_minibatch_kmeans_seeds(self):
+        # Default settings recover every blob whatever the stream order
+        for seed in range(20):
+            blobs = make_blobs(seed)
+            blobs = blobs[np.random.RandomState(seed).permutation(len(blobs))]
+            km = MiniBatchKMeans(16, seed=seed).fit(blobs, batch_size=50)
+            self.assertEqual(len(np.unique(km.predict(blobs))), 16)
+
+    def test_minibatch_kmeans_reassignment(self):
+        # Seeding from 48 samples misses a blob for some of these seeds,
+        # which reassignment recovers from
+        for seed in range(20):
+            blobs = make_blobs(seed)
+            blobs = blobs[np.random.RandomState(seed).permutation(len(blobs))]
+            km = MiniBatchKMeans(
+                16, init_size=48, reassignment_ratio=0.1, seed=seed
+            )
+            km.fit(blobs, n_passes=3, batch_size=50)
+            self.assertEqual(len(np.unique(km.predict(blobs))), 16)
+
+    def test_memmap_float16(self):
+        # The CPU backends read float16 memory-mapped features as they are
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "features.npy")
+            np.save(path, make_blobs().astype(np.float16))
+            features = np.load(path, mmap_mode="r")
+            for method in ["cpu", "hierarchical"]:
+                km = KMeansWrapper(features, 16, n_init=1, method=method)
+                self.assertEqual(km.centers.dtype, np.float32)
+                self.assertEqual(len(np.unique(km.y_pred)), 16)
+                y = np.asarray(km.y_pred).reshape(16, 30)
+                self.assertTrue(np.all(y == y[:, :1]))
+            del features
+
+    def test_cluster_batch_sampler(self):
+        sampler = ClusterBatchSampler(y_pred, batch_size=64, seed=0)
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        self.assertEqual(
+            sorted(i for batch in batches for i in batch), list(range(500))
+        )
+        # Every cluster spans consecutive batches only
+        for cluster in range(20):
+            hits = [n for n, b in enumerate(batches) if cluster in y_pred[b]]
+            self.assertEqual(hits, list(range(hits[0], hits[-1] + 1)))
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# %%
+import unittest
+
+# %%
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, TensorDataset
+
+# %%
+from clustre.attacking import fgsm, pgd
+from clustre.helpers.metrics import transfer_matrix
+
+# %%
+torch.manual_seed(0)
+model_a = nn.Sequential(nn.Flatten(), nn.Linear(16, 10))
+model_b = nn.Sequential(
+    nn.Flatten(), nn.Linear(16, 32), nn.ReLU(), nn.Linear(32, 10)
+)
+X = torch.rand(60, 1, 4, 4) * 2 - 1
+y = torch.randint(0, 10, (60,))
+loader = DataLoader(TensorDataset(X, y), batch_size=16)
+ATTACKS = {
+    "fgsm": (fgsm, "fgsm", {"epsilon": 0.1}),
+    "pgd": (pgd, "pgd", {"epsilon": 0.1, "n_epoches": 5}),
+}
+
+
+def self_accuracy(model, attack, params):
+    result = attack(
+        model, nn.CrossEntropyLoss(), X, y, return_result=True, **params
+    )
+    return 1 - result.success.float().mean().item()
+
+
+# %%
+class TestTransferMatrix(unittest.TestCase):
+    def test_transfer_matrix(self):
+        # Targets in the reverse order of the sources
+        matrices = transfer_matrix(
+            {"a": model_a, "b": model_b},
+            {"b": model_b, "a": model_a},
+            loader,
+            {
+                name: (attack, params)
+                for name, (_, attack, params) in ATTACKS.items()
+            },
+        )
+        self.assertListEqual(sorted(matrices), ["fgsm", "pgd"])
+        for name, (attack, _, params) in ATTACKS.items():
+            matrix = matrices[name]
+            self.assertTupleEqual(matrix.shape, (2, 2))
+            self.assertTrue(((matrix >= 0) & (matrix <= 1)).all())
+            # Rows follow the sources and columns the targets
+            self.assertAlmostEqual(
+                matrix[0, 1], self_accuracy(model_a, attack, params)
+            )
+            self.assertAlmostEqual(
+                matrix[1, 0], self_accuracy(model_b, attack, params)
+            )
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# %%
+import os
+import tempfile
+import unittest
+
+# %%
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import TensorDataset
+
+# %%
+from clustre.attacking import parallel_attack, pgd_perturbs
+
+# %%
+torch.manual_seed(0)
+model = nn.Sequential(
+    nn.Flatten(), nn.Linear(16, 32), nn.ReLU(), nn.Linear(32, 10)
+)
+X = torch.rand(50, 1, 4, 4) * 2 - 1
+y = torch.randint(0, 10, (50,))
+dataset = TensorDataset(X, y)
+
+
+# %%
+class TestParallelAttack(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "perturbs.npy")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matches_serial(self):
+        perturbs = parallel_attack(
+            model,
+            dataset,
+            "pgd",
+            self.path,
+            n_workers=2,
+            threads_per_worker=1,
+            batch_size=8,
+            shard_size=16,
+            n_epoches=10,
+        )
+        serial = pgd_perturbs(model, nn.CrossEntropyLoss(), X, y, n_epoches=10)
+        self.assertTupleEqual(perturbs.shape, tuple(X.shape))
+        self.assertTrue(np.array_equal(perturbs, serial.numpy()))
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
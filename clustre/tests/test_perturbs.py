@@ -0,0 +1,55 @@
+# %%
+import os
+import tempfile
+import unittest
+
+# %%
+import numpy as np
+
+# %%
+from clustre.helpers import load_perturbs, save_perturbs
+
+# %%
+rng = np.random.RandomState(0)
+ternary = (0.3 * rng.choice([-1, 0, 1], size=(50, 1, 28, 28))).astype(
+    np.float32
+)
+continuous = rng.uniform(-0.3, 0.3, size=(50, 1, 28, 28)).astype(np.float32)
+
+
+# %%
+class TestPerturbs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "perturbs")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ternary_roundtrip(self):
+        save_perturbs(self.path, ternary)
+        reader = load_perturbs(self.path)
+        self.assertEqual(reader.encoding, "ternary")
+        self.assertTrue(np.array_equal(np.asarray(reader), ternary))
+
+    def test_ternary_size(self):
+        save_perturbs(self.path, ternary)
+        self.assertLess(os.path.getsize(self.path), ternary.nbytes / 15)
+
+    def test_continuous_roundtrip(self):
+        save_perturbs(self.path, continuous)
+        reader = load_perturbs(self.path)
+        self.assertEqual(reader.encoding, "float16")
+        self.assertTrue(np.allclose(np.asarray(reader), continuous, atol=1e-3))
+
+    def test_lazy_slices(self):
+        save_perturbs(self.path, ternary)
+        reader = load_perturbs(self.path)
+        self.assertTrue(np.array_equal(reader[3], ternary[3]))
+        self.assertTrue(np.array_equal(reader[10:20], ternary[10:20]))
+        self.assertTrue(np.array_equal(reader[[1, 7]], ternary[[1, 7]]))
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
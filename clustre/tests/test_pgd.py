@@ -6,7 +6,7 @@ import torch
 from torch import nn
 
 # %%
-from clustre.attacking import pgd
+from clustre.attacking import pgd, pgd_perturbs
 from clustre.helpers.datasets import mnist_testloader
 from clustre.models import mnist_cnn
 from clustre.models.state_dicts import mnist_cnn_state
@@ -36,6 +36,38 @@ class TestPgd(unittest.TestCase):
         results = pgd(mnist_cnn, nn.CrossEntropyLoss(), batch_X, batch_y)
         self.assertTrue(((results >= -1) & (results <= 1)).all())
 
+    def test_pgd_restarts_shape(self):
+        results = pgd(
+            mnist_cnn,
+            nn.CrossEntropyLoss(),
+            batch_X,
+            batch_y,
+            n_restarts=3,
+            max_batch_size=64,
+        )
+        self.assertTupleEqual(results.shape, batch_X.shape)
+
+    def test_pgd_adaptive_bound(self):
+        perturbs = pgd_perturbs(
+            mnist_cnn, nn.CrossEntropyLoss(), batch_X, batch_y, adaptive=True
+        )
+        self.assertTrue((perturbs.abs() <= 0.3 + 1e-6).all())
+
+    def test_pgd_result(self):
+        result = pgd(
+            mnist_cnn,
+            nn.CrossEntropyLoss(),
+            batch_X,
+            batch_y,
+            early_stop=True,
+            return_result=True,
+        )
+        self.assertTupleEqual(result.adversarial.shape, batch_X.shape)
+        self.assertTupleEqual(result.logits.shape, (len(batch_X), 10))
+        self.assertTrue(
+            (result.success == (result.predictions != batch_y)).all()
+        )
+
 
 class TestPgdCuda(unittest.TestCase):
     def test_pgd_shape(self):
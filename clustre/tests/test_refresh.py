@@ -0,0 +1,84 @@
+# %%
+import math
+import unittest
+from unittest import mock
+
+# %%
+import numpy as np
+import torch
+from torch import nn
+
+# %%
+from clustre.adversarial_training._refresh import (
+    CentroidRefresher,
+    LazyCentroidPerturbs,
+)
+from clustre.adversarial_training._sampler import ClusterBatchSampler
+from clustre.attacking import pgd_perturbs
+
+# %%
+torch.manual_seed(0)
+model = nn.Sequential(nn.Flatten(), nn.Linear(16, 10))
+centroids_X = torch.rand(20, 1, 4, 4) * 2 - 1
+centroids_y = torch.randint(0, 10, (20,))
+
+
+# %%
+class TestCentroidRefresher(unittest.TestCase):
+    def test_refresh(self):
+        refresher = CentroidRefresher(
+            centroids_X,
+            centroids_y,
+            pgd_parameters={"n_epoches": 5},
+            refresh_fraction=0.2,
+            max_age=3,
+        )
+        perturbs = refresher.refresh(model)
+        self.assertTupleEqual(perturbs.shape, centroids_X.shape)
+        # Every centroid is attacked on the first epoch
+        self.assertTrue((refresher.age == 0).all())
+
+        n_fraction = math.ceil(0.2 * len(centroids_X))
+        for _ in range(5):
+            n_aged = int((refresher.age + 1 >= 3).sum())
+            refresher.refresh(model)
+            n_refreshed = int((refresher.age == 0).sum())
+            self.assertEqual(n_refreshed, n_fraction + n_aged)
+            self.assertTrue((refresher.age < 3).all())
+
+
+class TestLazyCentroidPerturbs(unittest.TestCase):
+    def test_attacked_once_per_epoch(self):
+        # 600 samples in 400 clusters: a batch of 128 spans more clusters
+        # than the cache holds
+        ids = np.concatenate(
+            [np.arange(400), np.random.RandomState(0).randint(0, 400, 200)]
+        )
+        X = torch.rand(400, 1, 4, 4) * 2 - 1
+        y = torch.randint(0, 10, (400,))
+        lazy = LazyCentroidPerturbs(
+            X, y, pgd_parameters={"n_epoches": 1}, max_size=64
+        )
+        with mock.patch(
+            "clustre.adversarial_training._refresh.pgd_perturbs",
+            wraps=pgd_perturbs,
+        ) as attack:
+            for seed in range(3):
+                attack.reset_mock()
+                lazy.clear()
+                sampler = ClusterBatchSampler(ids, batch_size=128, seed=seed)
+                for batch in sampler:
+                    cluster_idx = torch.from_numpy(ids[batch])
+                    perturbs = lazy.perturbs(model, cluster_idx)
+                    self.assertTupleEqual(
+                        perturbs.shape, (len(batch), 1, 4, 4)
+                    )
+                n_attacked = sum(
+                    len(call.args[2]) for call in attack.call_args_list
+                )
+                self.assertEqual(n_attacked, 400)
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# %%
+import unittest
+
+# %%
+import torch
+from torch import nn
+
+# %%
+from clustre.attacking import (
+    attack_session,
+    fgsm_perturbs,
+    maxloss_perturbs,
+    pgd_perturbs,
+)
+
+# %%
+torch.manual_seed(0)
+X = torch.rand(8, 1, 4, 4) * 2 - 1
+y = torch.randint(0, 10, (8,))
+
+
+def make_model():
+    model = nn.Sequential(nn.Flatten(), nn.Linear(16, 10))
+    # One frozen parameter, whose flag must be kept as well
+    model[1].bias.requires_grad_(False)
+    return model
+
+
+# %%
+class TestAttackSession(unittest.TestCase):
+    def test_flags_restored(self):
+        model = make_model()
+        with attack_session(model):
+            for p in model.parameters():
+                self.assertFalse(p.requires_grad)
+        self.assertTrue(model[1].weight.requires_grad)
+        self.assertFalse(model[1].bias.requires_grad)
+
+    def test_flags_restored_after_exception(self):
+        model = make_model()
+        with self.assertRaises(RuntimeError):
+            with attack_session(model):
+                raise RuntimeError
+        self.assertTrue(model[1].weight.requires_grad)
+        self.assertFalse(model[1].bias.requires_grad)
+
+    def test_no_weight_gradients(self):
+        criterion = nn.CrossEntropyLoss()
+        attacks = [
+            lambda model: fgsm_perturbs(model, criterion, X, y),
+            lambda model: pgd_perturbs(model, criterion, X, y, n_epoches=3),
+            lambda model: maxloss_perturbs(
+                model, criterion, X, y, n_epoches=3
+            ),
+        ]
+        for attack in attacks:
+            model = make_model()
+            attack(model)
+            for p in model.parameters():
+                self.assertIsNone(p.grad)
+            self.assertTrue(model[1].weight.requires_grad)
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# %%
+import tempfile
+import unittest
+
+# %%
+import numpy as np
+
+# %%
+from clustre.adversarial_training import ClusterStore, KMeansWrapper
+
+# %%
+rng = np.random.RandomState(0)
+X = rng.normal(size=(100, 8)).astype(np.float32)
+centers = X[:5].copy()
+y_pred = rng.randint(0, 5, size=100)
+km = KMeansWrapper.from_result(X, centers, y_pred)
+
+
+# %%
+class TestClusterStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_roundtrip(self):
+        store = ClusterStore(self.directory.name)
+        self.assertIsNone(store.load("a"))
+        store.save("a", km, reducer={"n_components": 4})
+        loaded, reducer = store.load("a")
+        self.assertTrue(np.array_equal(loaded.y_pred, y_pred))
+        self.assertTrue(np.array_equal(loaded.centers, centers))
+        self.assertTrue(
+            np.array_equal(loaded.centroids_idxs, km.centroids_idxs)
+        )
+        self.assertAlmostEqual(loaded.inertia, km.inertia, places=3)
+        self.assertEqual(reducer, {"n_components": 4})
+
+    def test_evict(self):
+        store = ClusterStore(self.directory.name)
+        store.save("a", km)
+        entry_size = store.size()
+        # Room for two entries
+        store.max_size = 2 * entry_size
+        store.save("b", km)
+        # "a" becomes the most recently used entry, so "b" is evicted
+        store.load("a")
+        store.save("c", km)
+        self.assertIsNotNone(store.load("a"))
+        self.assertIsNone(store.load("b"))
+        self.assertIsNotNone(store.load("c"))
+        self.assertEqual(store.size(), 2 * entry_size)
+
+        # The entry just saved is kept even if it does not fit
+        store.max_size = 1
+        store.save("d", km)
+        self.assertIsNotNone(store.load("d"))
+        self.assertEqual(store.size(), entry_size)
+
+        store.clear()
+        self.assertEqual(store.size(), 0)
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
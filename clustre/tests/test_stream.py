@@ -0,0 +1,94 @@
+# %%
+import os
+import tempfile
+import unittest
+
+# %%
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, Dataset, TensorDataset
+
+# %%
+from clustre.attacking import attack_stream, pgd_perturbs
+from clustre.helpers import load_perturbs
+
+# %%
+torch.manual_seed(0)
+model = nn.Sequential(
+    nn.Flatten(), nn.Linear(16, 32), nn.ReLU(), nn.Linear(32, 10)
+)
+X = torch.rand(50, 1, 4, 4) * 2 - 1
+y = torch.randint(0, 10, (50,))
+dataset = TensorDataset(X, y)
+
+
+class FailingDataset(Dataset):
+    """Dataset whose samples past `n_valid` cannot be loaded"""
+
+    def __init__(self, n_valid):
+        self.n_valid = n_valid
+
+    def __len__(self):
+        return len(dataset)
+
+    def __getitem__(self, idx):
+        if idx >= self.n_valid:
+            raise IndexError(f"Sample {idx} cannot be loaded")
+        return dataset[idx]
+
+
+# %%
+class TestAttackStream(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_offsets(self):
+        # 50 samples in batches of 16: the last batch is partial
+        loader = DataLoader(dataset, batch_size=16, shuffle=False)
+        serial = pgd_perturbs(
+            model, nn.CrossEntropyLoss(), X, y, n_epoches=5
+        ).numpy()
+        for prefetch in [True, False]:
+            path = os.path.join(self.directory.name, f"{prefetch}.npy")
+            batches = list(
+                attack_stream(
+                    model,
+                    loader,
+                    "pgd",
+                    out=path,
+                    prefetch=prefetch,
+                    n_epoches=5,
+                )
+            )
+            self.assertListEqual([len(b) for b in batches], [16, 16, 16, 2])
+            self.assertTrue(np.array_equal(torch.cat(batches).numpy(), serial))
+            self.assertTrue(np.array_equal(np.load(path), serial))
+
+    def test_packed(self):
+        loader = DataLoader(dataset, batch_size=16, shuffle=False)
+        path = os.path.join(self.directory.name, "perturbs")
+        batches = list(
+            attack_stream(model, loader, "fgsm", out=path, out_format="packed")
+        )
+        self.assertTrue(
+            np.array_equal(
+                np.asarray(load_perturbs(path)), torch.cat(batches).numpy()
+            )
+        )
+
+    def test_prefetch_exception(self):
+        loader = DataLoader(FailingDataset(20), batch_size=16, shuffle=False)
+        stream = attack_stream(model, loader, "fgsm", prefetch=True)
+        # The first batch is attacked, then the loader error is re-raised
+        self.assertEqual(len(next(stream)), 16)
+        with self.assertRaisesRegex(IndexError, "Sample 20"):
+            next(stream)
+
+
+# %%
+if __name__ == "__main__":
+    unittest.main()
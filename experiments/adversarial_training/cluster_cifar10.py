@@ -3,8 +3,13 @@ import logging
 import os
 import sys
 
+import numpy as np
 import torch
-from clustre.adversarial_training import cluster_training
+from clustre.adversarial_training import (
+    KMeansWrapper,
+    cluster_training,
+    extract_features,
+)
 from clustre.helpers.datasets import cifar10_testloader, cifar10_trainloader
 from clustre.helpers.metrics import (
     classification_report,
@@ -42,12 +47,28 @@ models = {
     ],
 }
 
-global_param = {"n_init": 3, "n_epoches": 40}
+global_param = {"n_epoches": 40}
+N_CLUSTERS = [500, 1000, 3000, 5000, 10000]
 
 # %%
 for model_name, (model, state, trainloader, testloader) in models.items():
     for cluster_with in ["original_data", "fgsm_perturb"]:
-        for n_clusters in [500, 1000, 3000, 5000, 10000]:
+        # Features of the base model are shared by every n_clusters, and
+        # each clustering is warm-started from the previous one
+        model.load_state_dict(state)
+        model.to(DEVICE)
+        if cluster_with == "original_data":
+            features = trainloader.dataset.data.reshape(
+                len(trainloader.dataset), -1
+            ).astype(np.float32)
+        else:
+            features = extract_features(
+                model, trainloader.dataset, cluster_with, device=DEVICE
+            )
+        kms = KMeansWrapper.sweep(features, N_CLUSTERS)
+        del features
+
+        for n_clusters in N_CLUSTERS:
             model.load_state_dict(state)
             logging.info(f"Training {model_name}")
             logging.info(
@@ -62,6 +83,7 @@ for model_name, (model, state, trainloader, testloader) in models.items():
                 log=log,
                 n_clusters=n_clusters,
                 cluster_with=cluster_with,
+                km=kms[n_clusters],
                 **global_param,
             )
             torch.save(
@@ -0,0 +1,57 @@
+# %%
+import logging
+import os
+
+from clustre.helpers.datasets import cifar10_testloader, mnist_testloader
+from clustre.helpers.metrics import transfer_matrix
+from clustre.models import (
+    cifar10_cnn,
+    cifar10_wide_resnet34_10,
+    mnist_cnn,
+    mnist_resnet18,
+)
+from clustre.models.state_dicts import (
+    cifar10_cnn_state,
+    cifar10_wide_resnet34_10_state,
+    mnist_cnn_state,
+    mnist_resnet18_state,
+)
+
+# %%
+DEVICE = "cuda"
+LOG_FILENAME = os.path.abspath(__file__)[:-3] + "_log.txt"
+FORMAT = "%(message)s"
+logging.basicConfig(filename=LOG_FILENAME, level=logging.INFO, format=FORMAT)
+
+# %%
+mnist_cnn.load_state_dict(mnist_cnn_state)
+mnist_resnet18.load_state_dict(mnist_resnet18_state)
+cifar10_cnn.load_state_dict(cifar10_cnn_state)
+cifar10_wide_resnet34_10.load_state_dict(cifar10_wide_resnet34_10_state)
+
+datasets = {
+    "MNIST": [
+        {"MNIST CNN": mnist_cnn, "MNIST ResNet18": mnist_resnet18},
+        mnist_testloader,
+    ],
+    "CIFAR-10": [
+        {
+            "CIFAR-10 CNN": cifar10_cnn,
+            "CIFAR-10 Wide ResNet34-10": cifar10_wide_resnet34_10,
+        },
+        cifar10_testloader,
+    ],
+}
+
+attacks = {"FGSM": "fgsm", "PGD": "pgd"}
+
+# %%
+for dataset_name, (models, testloader) in datasets.items():
+    accuracies = transfer_matrix(
+        models, models, testloader, attacks, device=DEVICE
+    )
+    for attack_name, accuracy in accuracies.items():
+        logging.info(f"{attack_name} transfer accuracy on {dataset_name}")
+        logging.info("source," + ",".join(models))
+        for source_name, row in zip(models, accuracy):
+            logging.info(source_name + "," + ",".join(f"{a:.4f}" for a in row))
@@ -0,0 +1,77 @@
+# %%
+import logging
+import os
+
+import torch
+from torch import nn
+
+from clustre.attacking import pgd_perturbs
+from clustre.helpers.datasets import cifar10_testloader, mnist_testloader
+from clustre.models import cifar10_cnn, mnist_cnn
+from clustre.models.state_dicts import cifar10_cnn_state, mnist_cnn_state
+
+# %%
+DEVICE = "cuda"
+N_BATCHES = 50
+BUDGETS = [5, 10, 20, 50, 100]
+LOG_FILENAME = os.path.abspath(__file__)[:-3] + "_log.txt"
+FORMAT = "%(message)s"
+logging.basicConfig(filename=LOG_FILENAME, level=logging.INFO, format=FORMAT)
+
+# %%
+mnist_cnn.load_state_dict(mnist_cnn_state)
+cifar10_cnn.load_state_dict(cifar10_cnn_state)
+
+models = {
+    "mnist_cnn": [mnist_cnn, mnist_testloader],
+    "cifar10_cnn": [cifar10_cnn, cifar10_testloader],
+}
+
+
+# %%
+def robust_accuracy(model, testloader, **pgd_params):
+    correct = 0
+    total = 0
+    for i, (images, labels) in enumerate(testloader):
+        if i == N_BATCHES:
+            break
+        images = images.to(DEVICE)
+        labels = labels.to(DEVICE)
+        perturbs = pgd_perturbs(
+            model, nn.CrossEntropyLoss(), images, labels, **pgd_params
+        )
+        with torch.no_grad():
+            output = model(torch.clamp(images + perturbs, min=-1, max=1))
+        correct += (output.argmax(dim=1) == labels).sum().item()
+        total += len(labels)
+    return correct / total
+
+
+# %%
+for model_name, (model, testloader) in models.items():
+    model.to(DEVICE)
+    logging.info(f"{model_name}")
+    logging.info("n_epoches,fixed_step,adaptive")
+    results = {}
+    for n_epoches in BUDGETS:
+        fixed = robust_accuracy(model, testloader, n_epoches=n_epoches)
+        adaptive = robust_accuracy(
+            model, testloader, n_epoches=n_epoches, adaptive=True
+        )
+        results[n_epoches] = (fixed, adaptive)
+        logging.info(f"{n_epoches},{fixed},{adaptive}")
+
+    # Fewest gradient evaluations at which the adaptive attack is at least as
+    # strong as the fixed-step attack with the full budget
+    target = results[BUDGETS[-1]][0]
+    reached = [n for n in BUDGETS if results[n][1] <= target]
+    if reached:
+        logging.info(
+            f"Adaptive PGD reaches the robust accuracy of {BUDGETS[-1]}-step "
+            f"PGD ({target}) in {reached[0]} iterations"
+        )
+    else:
+        logging.info(
+            f"Adaptive PGD does not reach the robust accuracy of "
+            f"{BUDGETS[-1]}-step PGD ({target})"
+        )
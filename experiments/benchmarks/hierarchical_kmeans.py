@@ -0,0 +1,41 @@
+# %%
+import logging
+import os
+import time
+
+import numpy as np
+
+from clustre.adversarial_training._kmeans import hierarchical_kmeans, kmeans
+from clustre.helpers.datasets import cifar10_trainset
+
+# %%
+N_CLUSTERS = [500, 1000, 3000, 5000, 10000]
+MAX_ITER = 20
+LOG_FILENAME = os.path.abspath(__file__)[:-3] + "_log.txt"
+FORMAT = "%(message)s"
+logging.basicConfig(filename=LOG_FILENAME, level=logging.INFO, format=FORMAT)
+
+# %%
+X = cifar10_trainset.data.reshape(len(cifar10_trainset), -1)
+X = X.astype(np.float32)
+
+backends = {
+    "flat": lambda k: kmeans(X, k, max_iter=MAX_ITER, seed=0),
+    "two-level": lambda k: hierarchical_kmeans(
+        X, k, max_iter=MAX_ITER, seed=0
+    ),
+    "branching 8": lambda k: hierarchical_kmeans(
+        X, k, branching=8, max_iter=MAX_ITER, seed=0
+    ),
+}
+
+# %%
+logging.info(f"{X.shape}, max_iter = {MAX_ITER}, {os.cpu_count()} CPUs")
+logging.info("n_clusters,backend,time_s,inertia")
+for n_clusters in N_CLUSTERS:
+    for name, fit in backends.items():
+        start = time.perf_counter()
+        centers, y_pred = fit(n_clusters)
+        elapsed = time.perf_counter() - start
+        inertia = np.sum(np.square(X - centers[y_pred]), dtype=np.float64)
+        logging.info(f"{n_clusters},{name},{elapsed:.1f},{inertia:.4g}")
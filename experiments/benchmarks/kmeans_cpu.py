@@ -0,0 +1,45 @@
+# %%
+import logging
+import os
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+from clustre.adversarial_training._kmeans import kmeans
+from clustre.helpers.datasets import cifar10_trainset
+
+# %%
+N_CLUSTERS = [500, 1000, 3000, 5000, 10000]
+MAX_ITER = 20
+LOG_FILENAME = os.path.abspath(__file__)[:-3] + "_log.txt"
+FORMAT = "%(message)s"
+logging.basicConfig(filename=LOG_FILENAME, level=logging.INFO, format=FORMAT)
+
+# %%
+# Same features as `cluster_with="original_data"` in cluster_cifar10.py
+X = cifar10_trainset.data.reshape(len(cifar10_trainset), -1)
+X = X.astype(np.float32)
+
+
+# %%
+def run_sklearn(n_clusters):
+    km = KMeans(n_clusters, n_init=1, max_iter=MAX_ITER, random_state=0)
+    km.fit(X)
+    return km.inertia_
+
+
+def run_cpu(n_clusters):
+    centers, y_pred = kmeans(X, n_clusters, max_iter=MAX_ITER, seed=0)
+    return float(np.sum(np.square(X - centers[y_pred]), dtype=np.float64))
+
+
+# %%
+logging.info(f"{X.shape}, max_iter = {MAX_ITER}, {os.cpu_count()} CPUs")
+logging.info("n_clusters,backend,time_s,inertia")
+for n_clusters in N_CLUSTERS:
+    for name, run in [("sklearn", run_sklearn), ("cpu", run_cpu)]:
+        start = time.perf_counter()
+        inertia = run(n_clusters)
+        elapsed = time.perf_counter() - start
+        logging.info(f"{n_clusters},{name},{elapsed:.1f},{inertia:.4g}")
@@ -0,0 +1,73 @@
+# %%
+import logging
+import os
+import time
+
+import torch
+from torch.autograd import profiler
+
+from clustre.attacking._pgd import pgd_step_
+
+# %%
+N_ITERATIONS = 50
+SHAPE = (128, 3, 32, 32)
+EPSILON = 0.3
+STEP_SIZE = 0.02
+LOG_FILENAME = os.path.abspath(__file__)[:-3] + "_log.txt"
+FORMAT = "%(message)s"
+logging.basicConfig(filename=LOG_FILENAME, level=logging.INFO, format=FORMAT)
+
+torch.manual_seed(0)
+torch.set_num_threads(1)
+
+
+# %%
+def unfused_step(images, grad, original_images):
+    images = images + (STEP_SIZE * torch.sign(grad))
+    images = torch.max(
+        torch.min(images, original_images + EPSILON),
+        original_images - EPSILON,
+    )
+    return images.detach()
+
+
+def fused_step(images, grad, lower, upper):
+    pgd_step_(images, grad, STEP_SIZE, lower, upper)
+    return images
+
+
+def run(step, setup):
+    original_images = torch.rand(SHAPE) * 2 - 1
+    grads = [torch.randn(SHAPE) for _ in range(N_ITERATIONS)]
+    images, args = setup(original_images)
+
+    start = time.perf_counter()
+    for grad in grads:
+        images = step(images, grad, *args)
+    elapsed = (time.perf_counter() - start) / N_ITERATIONS
+
+    grad = torch.randn(SHAPE)
+    with profiler.profile(profile_memory=True) as prof:
+        images = step(images, grad, *args)
+    allocated = sum(
+        e.self_cpu_memory_usage
+        for e in prof.function_events
+        if e.self_cpu_memory_usage > 0
+    )
+    return elapsed, allocated
+
+
+# %%
+unfused = run(unfused_step, lambda x: (x.clone(), (x,)))
+fused = run(
+    fused_step,
+    lambda x: (
+        x.clone(),
+        (torch.clamp(x - EPSILON, min=-1), torch.clamp(x + EPSILON, max=1)),
+    ),
+)
+
+logging.info(f"Batch {SHAPE}, {N_ITERATIONS} iterations, 1 thread")
+logging.info("step,time_per_iteration_ms,allocated_per_iteration_mb")
+for name, (elapsed, allocated) in [("unfused", unfused), ("fused", fused)]:
+    logging.info(f"{name},{elapsed * 1000:.3f},{allocated / 2 ** 20:.2f}")
@@ -0,0 +1,66 @@
+# %%
+import logging
+import os
+import time
+
+import numpy as np
+from scipy import sparse
+
+from clustre.adversarial_training._kmeans import kmeans
+from clustre.adversarial_training._reduce import reduce_features
+from clustre.helpers.datasets import cifar10_trainset, mnist_trainset
+
+# %%
+N_CLUSTERS = 1000
+MAX_ITER = 20
+REDUCTIONS = [
+    (None, None),
+    ("pca", 32),
+    ("pca", 128),
+    ("random_projection", 128),
+    ("random_projection", 512),
+]
+LOG_FILENAME = os.path.abspath(__file__)[:-3] + "_log.txt"
+FORMAT = "%(message)s"
+logging.basicConfig(filename=LOG_FILENAME, level=logging.INFO, format=FORMAT)
+
+# %%
+datasets = {
+    "MNIST": mnist_trainset.data.numpy().reshape(len(mnist_trainset), -1),
+    "CIFAR-10": cifar10_trainset.data.reshape(len(cifar10_trainset), -1),
+}
+
+
+# %%
+def raw_inertia(X, y_pred):
+    """Inertia of a clustering measured in the original space"""
+    one_hot = sparse.csr_matrix(
+        (np.ones(len(X)), (y_pred, np.arange(len(X)))),
+        shape=(N_CLUSTERS, len(X)),
+    )
+    counts = np.maximum(np.bincount(y_pred, minlength=N_CLUSTERS), 1)
+    centers = np.asarray(one_hot @ X) / counts[:, None]
+    return np.sum(np.square(X - centers[y_pred]))
+
+
+# %%
+logging.info(f"n_clusters = {N_CLUSTERS}, max_iter = {MAX_ITER}")
+logging.info("dataset,reduction,n_components,reduce_s,kmeans_s,raw_inertia")
+for name, X in datasets.items():
+    X = X.astype(np.float32)
+    for reduction, n_components in REDUCTIONS:
+        start = time.perf_counter()
+        if reduction is None:
+            d = X
+        else:
+            d, _ = reduce_features(X, reduction, n_components=n_components)
+        reduce_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, y_pred = kmeans(d, N_CLUSTERS, max_iter=MAX_ITER, seed=0)
+        kmeans_time = time.perf_counter() - start
+
+        logging.info(
+            f"{name},{reduction},{n_components},{reduce_time:.1f},"
+            f"{kmeans_time:.1f},{raw_inertia(X, y_pred):.4g}"
+        )
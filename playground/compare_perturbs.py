@@ -3,10 +3,15 @@ import matplotlib.pyplot as plt
 import numpy as np
 import numpy.linalg as la
 import seaborn as sns
-import torch
 from torch import nn
 
-from clustre.attacking import fgsm_perturbs, maxloss_perturbs, pgd_perturbs
+from clustre.attacking import (
+    attack_stream,
+    fgsm_perturbs,
+    maxloss_perturbs,
+    pgd_perturbs,
+)
+from clustre.helpers import load_perturbs
 from clustre.helpers.datasets import mnist_trainloader
 from clustre.models import mnist_cnn, mnist_resnet18
 from clustre.models.state_dicts import mnist_cnn_state, mnist_resnet18_state
@@ -25,102 +30,47 @@ mnist_resnet18.to("cuda")
 criterion = nn.CrossEntropyLoss()
 
 # %%
-cnn_fgsm = []
-for X, y in iter(mnist_trainloader):
-    X = X.to("cuda")
-    y = y.to("cuda")
-    p = fgsm_perturbs(mnist_cnn, criterion, X, y)
-    cnn_fgsm.append(p)
-
-# %%
-cnn_pgd = []
-for X, y in iter(mnist_trainloader):
-    X = X.to("cuda")
-    y = y.to("cuda")
-    p = pgd_perturbs(mnist_cnn, criterion, X, y)
-    cnn_pgd.append(p)
-
-# %%
-cnn_maxloss = []
-for X, y in iter(mnist_trainloader):
-    X = X.to("cuda")
-    y = y.to("cuda")
-    p = maxloss_perturbs(mnist_cnn, criterion, X, y)
-    cnn_maxloss.append(p)
-
-# %%
-resnet18_fgsm = []
-for X, y in iter(mnist_trainloader):
-    X = X.to("cuda")
-    y = y.to("cuda")
-    p = fgsm_perturbs(mnist_resnet18, criterion, X, y)
-    resnet18_fgsm.append(p)
-
-# %%
-resnet18_pgd = []
-for X, y in iter(mnist_trainloader):
-    X = X.to("cuda")
-    y = y.to("cuda")
-    p = pgd_perturbs(mnist_resnet18, criterion, X, y)
-    resnet18_pgd.append(p)
-
-# %%
-resnet18_maxloss = []
-for X, y in iter(mnist_trainloader):
-    X = X.to("cuda")
-    y = y.to("cuda")
-    p = maxloss_perturbs(mnist_resnet18, criterion, X, y)
-    resnet18_maxloss.append(p)
-
-# %%
-cnn_fgsm = torch.cat(cnn_fgsm)
-cnn_maxloss = torch.cat(cnn_maxloss)
-cnn_pgd = torch.cat(cnn_pgd)
-
-# %%
-resnet18_fgsm = torch.cat(resnet18_fgsm)
-resnet18_maxloss = torch.cat(resnet18_maxloss)
-resnet18_pgd = torch.cat(resnet18_pgd)
-
-# %%
-cnn_fgsm = cnn_fgsm.cpu().detach().numpy()
-cnn_maxloss = cnn_maxloss.cpu().detach().numpy()
-cnn_pgd = cnn_pgd.cpu().detach().numpy()
-
-# %%
-resnet18_fgsm = resnet18_fgsm.cpu().detach().numpy()
-resnet18_maxloss = resnet18_maxloss.cpu().detach().numpy()
-resnet18_pgd = resnet18_pgd.cpu().detach().numpy()
-
-# %%
-np.save("playground/perturbs/cnn_fgsm.npy", cnn_fgsm)
-np.save("playground/perturbs/cnn_pgd.npy", cnn_pgd)
-np.save("playground/perturbs/cnn_maxloss.npy", cnn_maxloss)
-np.save("playground/perturbs/resnet18_fgsm.npy", resnet18_fgsm)
-np.save("playground/perturbs/resnet18_pgd.npy", resnet18_pgd)
-np.save("playground/perturbs/resnet18_maxloss.npy", resnet18_maxloss)
-
-# %%
-cnn_fgsm = np.load("playground/perturbs/cnn_fgsm.npy")
-cnn_pgd = np.load("playground/perturbs/cnn_pgd.npy")
-cnn_maxloss = np.load("playground/perturbs/cnn_maxloss.npy")
-resnet18_fgsm = np.load("playground/perturbs/resnet18_fgsm.npy")
-resnet18_pgd = np.load("playground/perturbs/resnet18_pgd.npy")
-resnet18_maxloss = np.load("playground/perturbs/resnet18_maxloss.npy")
+attacks = {
+    "fgsm": fgsm_perturbs,
+    "pgd": pgd_perturbs,
+    "maxloss": maxloss_perturbs,
+}
+for model_name, model in [("cnn", mnist_cnn), ("resnet18", mnist_resnet18)]:
+    for attack_name, attack in attacks.items():
+        for _ in attack_stream(
+            model,
+            mnist_trainloader,
+            attack,
+            criterion=criterion,
+            out=f"playground/perturbs/{model_name}_{attack_name}.perturbs",
+            out_format="packed",
+            device="cuda",
+        ):
+            pass
+
+# %%
+cnn_fgsm = load_perturbs("playground/perturbs/cnn_fgsm.perturbs")
+cnn_pgd = load_perturbs("playground/perturbs/cnn_pgd.perturbs")
+cnn_maxloss = load_perturbs("playground/perturbs/cnn_maxloss.perturbs")
+resnet18_fgsm = load_perturbs("playground/perturbs/resnet18_fgsm.perturbs")
+resnet18_pgd = load_perturbs("playground/perturbs/resnet18_pgd.perturbs")
+resnet18_maxloss = load_perturbs(
+    "playground/perturbs/resnet18_maxloss.perturbs"
+)
 
 # %%
 cnn_random_fgsm = []
 for i in range(100):
-    p = np.load(
-        f"playground/random_fgsm_perturbs/random_fgsm_mnist_cnn_{i}.npy"
+    p = load_perturbs(
+        f"playground/random_fgsm_perturbs/random_fgsm_mnist_cnn_{i}.perturbs"
     )
     cnn_random_fgsm.append(p)
 
 # %%
 resnet18_random_fgsm = []
 for i in range(100):
-    p = np.load(
-        f"playground/random_fgsm_perturbs/random_fgsm_mnist_resnet18_{i}.npy"
+    p = load_perturbs(
+        f"playground/random_fgsm_perturbs/random_fgsm_mnist_resnet18_{i}.perturbs"
     )
     resnet18_random_fgsm.append(p)
 
@@ -1,11 +1,10 @@
 # %%
-import numpy as np
 import numpy.linalg as la
 import seaborn as sns
 import torch
 from torch import nn
 
-from clustre.attacking import fgsm_perturbs
+from clustre.attacking import attack_stream, fgsm_perturbs
 from clustre.helpers.datasets import mnist_trainloader
 from clustre.models import mnist_cnn, mnist_resnet18
 from clustre.models.state_dicts import mnist_cnn_state, mnist_resnet18_state
@@ -27,29 +26,30 @@ criterion = nn.CrossEntropyLoss()
 for i in range(100):
     print(i)
     torch.manual_seed(i)
-    ps = []
-    for X, y in iter(mnist_trainloader):
-        X = X.to("cuda")
-        y = y.to("cuda")
-        p = fgsm_perturbs(mnist_cnn, criterion, X, y, random=True)
-        ps.append(p)
-    ps = torch.cat(ps).cpu().detach().numpy()
-    np.save(
-        f"playground/random_fgsm_perturbs/random_fgsm_mnist_cnn_{i}.npy", ps
-    )
+    for _ in attack_stream(
+        mnist_cnn,
+        mnist_trainloader,
+        fgsm_perturbs,
+        criterion=criterion,
+        out=f"playground/random_fgsm_perturbs/random_fgsm_mnist_cnn_{i}.perturbs",
+        out_format="packed",
+        device="cuda",
+        random=True,
+    ):
+        pass
 
 # %%
 for i in range(100):
     print(i)
     torch.manual_seed(i)
-    ps = []
-    for X, y in iter(mnist_trainloader):
-        X = X.to("cuda")
-        y = y.to("cuda")
-        p = fgsm_perturbs(mnist_resnet18, criterion, X, y, random=True)
-        ps.append(p)
-    ps = torch.cat(ps).cpu().detach().numpy()
-    np.save(
-        f"playground/random_fgsm_perturbs/random_fgsm_mnist_resnet18_{i}.npy",
-        ps,
-    )
+    for _ in attack_stream(
+        mnist_resnet18,
+        mnist_trainloader,
+        fgsm_perturbs,
+        criterion=criterion,
+        out=f"playground/random_fgsm_perturbs/random_fgsm_mnist_resnet18_{i}.perturbs",
+        out_format="packed",
+        device="cuda",
+        random=True,
+    ):
+        pass